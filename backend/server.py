@@ -1,19 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Response, Request, Query, UploadFile, File
+from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 import asyncpg
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Annotated
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timezone
 import bcrypt
 from jose import JWTError, jwt
 from datetime import timedelta
 import json
+import gzip
+import hashlib
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+import heapq
+import re
+import csv
+import io
+import base64
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import httpx
+import orjson
+import numpy as np
+
+try:
+    import msgspec
+except ImportError:  # optional: FAST_JSON falls back to pydantic's JSON parser
+    msgspec = None
+
+try:
+    import brotli
+except ImportError:  # optional: responses are gzip-only without it
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -22,9 +52,114 @@ load_dotenv(ROOT_DIR / '.env')
 database_url = os.environ['DATABASE_URL']
 db_pool = None
 
+# Cross-worker cache invalidation (LISTEN/NOTIFY needs a session-mode connection, not pgbouncer transaction mode)
+CACHE_INVALIDATION_CHANNEL = os.environ.get("CACHE_INVALIDATION_CHANNEL", "cargo_cache_invalidation")
+CACHE_INVALIDATION_LISTENER = os.environ.get("CACHE_INVALIDATION_LISTENER", "true").lower() == "true"
+DATABASE_LISTEN_URL = os.environ.get("DATABASE_LISTEN_URL") or database_url
+LISTENER_HEALTHCHECK_INTERVAL = float(os.environ.get("LISTENER_HEALTHCHECK_INTERVAL", "30"))
+cache_listener_task = None
+
 # n8n integration endpoints
 N8N_WEBHOOK_BASE = "https://n8n.by/webhook"
 
+# Shared outbound HTTP client for n8n webhooks (keep-alive pool, created on startup)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "false").lower() == "true"
+
+# Opt-in fast path: orjson response bytes and msgspec request decoding for search/booking
+FAST_JSON = os.environ.get("FAST_JSON", "false").lower() == "true"
+WEBHOOK_TIMEOUTS = {
+    "search": float(os.environ.get("WEBHOOK_SEARCH_TIMEOUT", "30")),
+    "calculate": float(os.environ.get("WEBHOOK_CALCULATE_TIMEOUT", "30")),
+    "booking": float(os.environ.get("WEBHOOK_BOOKING_TIMEOUT", "30")),
+}
+WEBHOOK_CONNECT_TIMEOUT = float(os.environ.get("WEBHOOK_CONNECT_TIMEOUT", "5"))
+http_client = None
+
+# Search result cache (normalized webhook quotes keyed by webhook params)
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_STALE_TTL = float(os.environ.get("SEARCH_CACHE_STALE_TTL", "900"))  # 0 disables stale-while-revalidate
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Circuit breaker per search webhook URL
+CIRCUIT_WINDOW_SIZE = int(os.environ.get("CIRCUIT_WINDOW_SIZE", "20"))
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE_THRESHOLD = float(os.environ.get("CIRCUIT_FAILURE_RATE_THRESHOLD", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "10"))
+CIRCUIT_SLOW_CALL_RATE_THRESHOLD = float(os.environ.get("CIRCUIT_SLOW_CALL_RATE_THRESHOLD", "0.8"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.environ.get("CIRCUIT_HALF_OPEN_CALLS", "2"))
+
+# Hedged search webhook requests (off by default)
+SEARCH_HEDGING_ENABLED = os.environ.get("SEARCH_HEDGING_ENABLED", "false").lower() == "true"
+SEARCH_HEDGE_PERCENTILE = float(os.environ.get("SEARCH_HEDGE_PERCENTILE", "0.95"))
+SEARCH_HEDGE_DEFAULT_DELAY = float(os.environ.get("SEARCH_HEDGE_DEFAULT_DELAY", "2"))  # until enough samples exist
+SEARCH_HEDGE_MIN_DELAY = float(os.environ.get("SEARCH_HEDGE_MIN_DELAY", "0.2"))
+SEARCH_HEDGE_MIN_SAMPLES = int(os.environ.get("SEARCH_HEDGE_MIN_SAMPLES", "20"))
+SEARCH_HEDGE_MAX_RATE = float(os.environ.get("SEARCH_HEDGE_MAX_RATE", "0.1"))  # hedges per primary request
+
+# Multi-leg itineraries: extra days added for every transshipment
+ROUTE_TRANSFER_DAYS = int(os.environ.get("ROUTE_TRANSFER_DAYS", "2"))
+
+# Departure calendars precomputed from ShippingRoute.frequency
+SCHEDULE_HORIZON_DAYS = int(os.environ.get("SCHEDULE_HORIZON_DAYS", "365"))
+SCHEDULE_BOOKING_CUTOFF_DAYS = int(os.environ.get("SCHEDULE_BOOKING_CUTOFF_DAYS", "3"))
+SCHEDULE_MAX_SAILINGS = int(os.environ.get("SCHEDULE_MAX_SAILINGS", "31"))
+
+# Flexible-date price calendar
+CALENDAR_MAX_WINDOWS = int(os.environ.get("CALENDAR_MAX_WINDOWS", "62"))
+CALENDAR_CONCURRENCY = int(os.environ.get("CALENDAR_CONCURRENCY", "6"))
+
+# Batch search
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+
+# Admin routes listing
+ADMIN_ROUTES_PAGE_SIZE = int(os.environ.get("ADMIN_ROUTES_PAGE_SIZE", "500"))
+ADMIN_ROUTES_MAX_PAGE_SIZE = int(os.environ.get("ADMIN_ROUTES_MAX_PAGE_SIZE", "5000"))
+ADMIN_ROUTES_EXPORT_PREFETCH = int(os.environ.get("ADMIN_ROUTES_EXPORT_PREFETCH", "1000"))
+
+# Bulk imports
+IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "5000"))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "100"))
+
+# Global deadline for querying all search providers concurrently
+SEARCH_DEADLINE_SECONDS = float(os.environ.get("SEARCH_DEADLINE_SECONDS", "25"))
+
+# Booking outbox delivery
+BOOKING_OUTBOX_CONCURRENCY = int(os.environ.get("BOOKING_OUTBOX_CONCURRENCY", "4"))
+BOOKING_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("BOOKING_OUTBOX_MAX_ATTEMPTS", "10"))
+BOOKING_OUTBOX_BACKOFF_BASE = float(os.environ.get("BOOKING_OUTBOX_BACKOFF_BASE", "5"))
+BOOKING_OUTBOX_BACKOFF_MAX = float(os.environ.get("BOOKING_OUTBOX_BACKOFF_MAX", "1800"))
+BOOKING_OUTBOX_POLL_INTERVAL = float(os.environ.get("BOOKING_OUTBOX_POLL_INTERVAL", "5"))
+# A claimed booking becomes visible to other dispatchers again if not settled within the lease
+BOOKING_OUTBOX_LEASE_SECONDS = float(os.environ.get("BOOKING_OUTBOX_LEASE_SECONDS", "120"))
+booking_dispatcher_task = None
+
+# Buffered calculate_clicks writes; CLICK_BUFFER_MAX_PENDING bounds what a crash can lose
+CLICK_BUFFER_FLUSH_SIZE = int(os.environ.get("CLICK_BUFFER_FLUSH_SIZE", "200"))
+CLICK_BUFFER_FLUSH_INTERVAL = float(os.environ.get("CLICK_BUFFER_FLUSH_INTERVAL", "2"))
+CLICK_BUFFER_MAX_PENDING = int(os.environ.get("CLICK_BUFFER_MAX_PENDING", "10000"))
+click_flusher_task = None
+
+# Reference data cache (ports, container types, cargo types)
+REFERENCE_CACHE_MAX_AGE = float(os.environ.get("REFERENCE_CACHE_MAX_AGE", "3600"))
+# Browsers keep reference responses and revalidate them with If-None-Match
+REFERENCE_CACHE_CONTROL = os.environ.get("REFERENCE_CACHE_CONTROL", "public, no-cache")
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+http_stats = {
+    endpoint: {"requests": 0, "errors": 0, "new_connections": 0, "total_time_ms": 0.0}
+    for endpoint in WEBHOOK_TIMEOUTS
+}
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -37,6 +172,16 @@ SECRET_KEY = "cargo_platform_secret_key_2025"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Password hashing (bcrypt runs in a thread pool, never on the event loop)
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_MAX_CONCURRENCY = int(os.environ.get("BCRYPT_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+BCRYPT_QUEUE_LIMIT = int(os.environ.get("BCRYPT_QUEUE_LIMIT", "64"))
+
+# Verified-token and user-existence caches for get_current_user
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000"))
+
 # Admin credentials (hardcoded for MVP)
 ADMIN_LOGIN = "admin"
 ADMIN_PASSWORD = "admin127"
@@ -60,6 +205,7 @@ class CargoType(BaseModel):
 class Port(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
+    name_en: Optional[str] = None
     code: str
     country: str
     city: str
@@ -108,6 +254,33 @@ class ShippingRoute(BaseModel):
     frequency: str  # Daily, Weekly, etc.
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class SearchProvider(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    webhook_url: str
+    enabled: bool = True
+
+class ItineraryQuery(BaseModel):
+    origin_port: str
+    destination_port: str
+    container_type: Optional[str] = None
+    sort_by: str = "price"  # price | transit_time
+    k: int = Field(default=5, ge=1, le=20)
+    max_hops: int = Field(default=3, ge=1, le=5)
+
+class PriceCalendarQuery(BaseModel):
+    origin_port: str
+    destination_port: str
+    date_from: date
+    date_to: date
+    container_type: str
+    granularity: str = "week"  # day | week
+    is_dangerous_cargo: bool = False
+    containers_count: int = 1
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery]
+
 class SearchResult(BaseModel):
     id: str
     origin_port: str
@@ -168,7 +341,76 @@ def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded thread pool and rejects work beyond the queue limit"""
+
+    def __init__(self, rounds: int, max_concurrency: int, queue_limit: int):
+        self.rounds = rounds
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self._waits_ms = deque(maxlen=1000)
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_concurrency + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many authentication requests, please retry")
+        self._pending += 1
+        submitted = time.perf_counter()
+
+        def job():
+            waited_ms = (time.perf_counter() - submitted) * 1000
+            return waited_ms, fn(*args)
+
+        try:
+            waited_ms, result = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self._pending -= 1
+        self._waits_ms.append(waited_ms)
+        self.completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(get_password_hash, password)
+        return hashed.decode('utf-8')
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        waits = sorted(self._waits_ms)
+        return {
+            "rounds": self.rounds,
+            "max_concurrency": self.max_concurrency,
+            "queue_limit": self.queue_limit,
+            "in_progress_or_queued": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "queue_wait_ms": {
+                "p50": round(waits[len(waits) // 2], 2) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)], 2) if waits else 0.0,
+                "max": round(waits[-1], 2) if waits else 0.0,
+            },
+        }
+
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, BCRYPT_MAX_CONCURRENCY, BCRYPT_QUEUE_LIMIT)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -180,6 +422,60 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class ExpiringLRUCache:
+    """LRU cache where every entry carries its own wall-clock expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def discard_where(self, predicate):
+        for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+token_cache = ExpiringLRUCache(TOKEN_CACHE_MAX_ENTRIES)  # token -> verified claims, kept until "exp"
+user_cache = ExpiringLRUCache(USER_CACHE_MAX_ENTRIES)  # user id -> {"id", "email"}
+
+def decode_access_token(token: str) -> dict:
+    """Verify a JWT once and reuse the claims until the token expires"""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.set(token, payload, payload.get("exp", time.time() + USER_CACHE_TTL))
+    return payload
+
+def invalidate_user(user_id: str):
+    user_cache.discard(user_id)
+    token_cache.discard_where(lambda payload: payload.get("sub") == user_id)
+
 async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
@@ -192,18 +488,24 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(credentials.credentials)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication")
         
+        cached_user = user_cache.get(user_id)
+        if cached_user is not None:
+            return cached_user
+        
         # Verify user exists in database
         pool = await get_db_pool()
         async with pool.acquire() as conn:
             user = await conn.fetchrow('SELECT id, email FROM users WHERE id = $1', user_id)
             if not user:
                 raise HTTPException(status_code=401, detail="User not found")
-            return {"id": user["id"], "email": user["email"]}
+        current_user = {"id": user["id"], "email": user["email"]}
+        user_cache.set(user_id, current_user, time.time() + USER_CACHE_TTL)
+        return current_user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication")
 
@@ -212,29 +514,1295 @@ async def verify_user_credentials(email: str, password: str):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         user = await conn.fetchrow('SELECT id, email, password_hash FROM users WHERE email = $1', email)
-        if not user:
-            return None
-        
-        if verify_password(password, user['password_hash'].encode('utf-8')):
-            return {"id": user["id"], "email": user["email"]}
+    if not user:
+        return None
+    
+    if not await password_hasher.verify(password, user['password_hash']):
         return None
+    
+    # Transparently upgrade hashes created with a different work factor
+    if password_hasher.needs_rehash(user['password_hash']):
+        new_hash = await password_hasher.hash(password)
+        async with pool.acquire() as conn:
+            await conn.execute('UPDATE users SET password_hash = $1 WHERE id = $2', new_hash, user['id'])
+        password_hasher.rehashed += 1
+        invalidate_user(user['id'])
+    return {"id": user["id"], "email": user["email"]}
 
 # Database connection and initialization
+# Binary wire format: json is the UTF-8 text itself, jsonb is a 0x01 version byte followed by the text
+JSONB_FORMAT_VERSION = b"\x01"
+
+def encode_json_column(value) -> bytes:
+    return orjson.dumps(value, default=json_default)
+
+def encode_jsonb_column(value) -> bytes:
+    return JSONB_FORMAT_VERSION + orjson.dumps(value, default=json_default)
+
+def decode_jsonb_column(data: bytes):
+    if data[:1] != JSONB_FORMAT_VERSION:
+        raise ValueError(f"Unsupported jsonb format version: {data[:1]!r}")
+    return orjson.loads(memoryview(data)[1:])
+
+async def init_db_connection(conn):
+    # json/jsonb values are decoded straight into lists/dicts (and lists/dicts accepted as parameters).
+    # The codecs must stay binary: copy_records_to_table (bulk import) only accepts binary-format codecs.
+    await conn.set_type_codec('json', encoder=encode_json_column, decoder=orjson.loads,
+                              schema='pg_catalog', format='binary')
+    await conn.set_type_codec('jsonb', encoder=encode_jsonb_column, decoder=decode_jsonb_column,
+                              schema='pg_catalog', format='binary')
+
 async def get_db_pool():
     global db_pool
     if db_pool is None:
-        db_pool = await asyncpg.create_pool(database_url, min_size=10, max_size=20, statement_cache_size=0)
+        db_pool = await asyncpg.create_pool(database_url, min_size=10, max_size=20, statement_cache_size=0,
+                                            init=init_db_connection)
     return db_pool
 
+# Shared HTTP client for all webhook calls
+async def get_http_client():
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=HTTP2_ENABLED,
+        )
+    return http_client
+
+async def webhook_request(endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a request to an n8n webhook through the shared connection pool"""
+    client = await get_http_client()
+    stats = http_stats[endpoint]
+
+    async def trace(event_name, info):
+        # Fires only when the pool has no warm connection to reuse
+        if event_name == "connection.connect_tcp.started":
+            stats["new_connections"] += 1
+
+    timeout = httpx.Timeout(WEBHOOK_TIMEOUTS[endpoint], connect=WEBHOOK_CONNECT_TIMEOUT)
+    started = time.perf_counter()
+    stats["requests"] += 1
+    try:
+        return await client.request(method, url, timeout=timeout, extensions={"trace": trace}, **kwargs)
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        stats["total_time_ms"] += (time.perf_counter() - started) * 1000
+
+def get_http_pool_stats():
+    connections = []
+    if http_client is not None:
+        pool = getattr(http_client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+    endpoints = {}
+    for endpoint, stats in http_stats.items():
+        requests_count = stats["requests"]
+        endpoints[endpoint] = {
+            **stats,
+            "timeout_seconds": WEBHOOK_TIMEOUTS[endpoint],
+            "reused_connections": max(requests_count - stats["new_connections"], 0),
+            "avg_time_ms": round(stats["total_time_ms"] / requests_count, 2) if requests_count else 0.0,
+        }
+    return {
+        "http2": HTTP2_ENABLED,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+        "open_connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "endpoints": endpoints,
+    }
+
+# Search result cache
+class SearchResultCache:
+    """In-process TTL + LRU cache bounded by entry count and total bytes"""
+
+    def __init__(self, ttl: float, stale_ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (stored_at, size_bytes, quotes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (quotes, is_stale) or None when the key is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, _, quotes = entry
+        age = time.monotonic() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if age >= self.ttl:
+            self.stale_hits += 1
+            return quotes, True
+        self.hits += 1
+        return quotes, False
+
+    def set(self, key, quotes: list):
+        size = len(json.dumps(quotes, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic(), size, quotes)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def purge(self) -> int:
+        purged = len(self._entries)
+        self._entries.clear()
+        self.total_bytes = 0
+        return purged
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+# Request coalescing for identical upstream calls
+class SingleFlight:
+    """Runs one task per key; concurrent callers with the same key share its result or error"""
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.deduplicated = 0
+
+    def start(self, key, factory):
+        """Return the in-flight task for key, creating it from factory() if there is none"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.deduplicated += 1
+            return task
+        task = asyncio.create_task(factory())
+        self._inflight[key] = task
+        self.started += 1
+
+        def done(finished):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+            # Mark the error as retrieved even if every waiter was cancelled
+            if not finished.cancelled() and finished.exception() is not None:
+                logging.debug(f"Coalesced call {key} failed: {finished.exception()}")
+
+        task.add_done_callback(done)
+        return task
+
+    async def do(self, key, factory):
+        # shield: a cancelled or timed-out caller must not cancel the call other waiters share
+        return await asyncio.shield(self.start(key, factory))
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.started,
+            "deduplicated": self.deduplicated,
+        }
+
+search_cache = SearchResultCache(SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_BYTES)
+search_flight = SingleFlight()
+
+def search_cache_key(webhook_url: str, webhook_params: dict) -> tuple:
+    return (
+        webhook_url,
+        str(webhook_params["from"]).strip().casefold(),
+        str(webhook_params["to"]).strip().casefold(),
+        webhook_params["container_size"],
+        webhook_params["date_from"],
+        webhook_params["date_to"],
+    )
+
+# Reference data cache
+REFERENCE_QUERIES = {
+    "container_types": 'SELECT * FROM container_types',
+    "cargo_types": 'SELECT * FROM cargo_types',
+    "ports": 'SELECT * FROM ports ORDER BY name',
+    "webhook_settings": 'SELECT webhook_url FROM webhook_settings LIMIT 1',
+    "search_providers": 'SELECT id, name, webhook_url FROM search_providers WHERE enabled ORDER BY name',
+    "shipping_routes": 'SELECT * FROM shipping_routes ORDER BY origin_port, destination_port',
+}
+
+def json_default(value):
+    """Encode database values the same way FastAPI's jsonable_encoder does"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+# Fast JSON path (FAST_JSON=true)
+def json_response(data):
+    """Encode straight to bytes with orjson, skipping FastAPI's jsonable_encoder pass"""
+    if not FAST_JSON:
+        return data
+    return Response(orjson.dumps(data, default=json_default), media_type="application/json")
+
+def fast_body(model):
+    """Dependency decoding the raw body with a msgspec Struct mirroring `model` (or pydantic's
+    JSON parser when msgspec is not installed); validation errors keep FastAPI's 422 shape"""
+    decoder = None
+    if msgspec is not None:
+        fields = [
+            (name, field.annotation) if field.is_required() else (name, field.annotation, field.default)
+            for name, field in model.model_fields.items()
+        ]
+        decoder = msgspec.json.Decoder(msgspec.defstruct(f"{model.__name__}Struct", fields, kw_only=True), strict=False)
+
+    async def decode(request: Request):
+        body = await request.body()
+        if decoder is not None:
+            try:
+                item = decoder.decode(body)
+            except (msgspec.ValidationError, msgspec.DecodeError) as e:
+                raise RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(e), "input": None}])
+            return model.model_construct(**msgspec.structs.asdict(item))
+        try:
+            return model.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)])
+
+    return decode
+
+if FAST_JSON:
+    SearchQueryBody = Annotated[SearchQuery, Depends(fast_body(SearchQuery))]
+    BookingRequestBody = Annotated[BookingRequest, Depends(fast_body(BookingRequest))]
+else:
+    SearchQueryBody = SearchQuery
+    BookingRequestBody = BookingRequest
+
+class ReferenceEntry:
+    def __init__(self, rows: list, body: bytes, generation: int):
+        self.rows = rows
+        self.body = body
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+        # Strong validator from the content itself, so every worker agrees on it
+        self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self._encoded = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        """Body compressed once per load and reused for every request"""
+        if encoding not in self._encoded:
+            self._encoded[encoding] = compress_body(self.body, encoding)
+        return self._encoded[encoding]
+
+class ReferenceDataCache:
+    """Loads rarely-changing tables once and keeps their pre-serialized JSON response"""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._entries = {}
+        self._generations = {table: 0 for table in REFERENCE_QUERIES}
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.loads = 0
+
+    async def get(self, table: str) -> ReferenceEntry:
+        entry = self._entries.get(table)
+        if entry is not None and entry.generation == self._generations[table] \
+                and time.monotonic() - entry.loaded_at < self.max_age:
+            self.hits += 1
+            return entry
+        return await self._flight.do(table, lambda: self._load(table))
+
+    async def _load(self, table: str) -> ReferenceEntry:
+        generation = self._generations[table]
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(REFERENCE_QUERIES[table])
+        results = [dict(row) for row in rows]
+        body = json.dumps(results, ensure_ascii=False, default=json_default).encode('utf-8')
+        entry = ReferenceEntry(results, body, generation)
+        # Do not publish data that was invalidated while it was loading
+        if generation == self._generations[table]:
+            self._entries[table] = entry
+        self.loads += 1
+        return entry
+
+    def invalidate(self, *tables: str):
+        for table in tables or tuple(REFERENCE_QUERIES):
+            self._generations[table] += 1
+            self._entries.pop(table, None)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "max_age_seconds": self.max_age,
+            "hits": self.hits,
+            "loads": self.loads,
+            "tables": {
+                table: {"rows": len(entry.rows), "bytes": len(entry.body), "age_seconds": round(now - entry.loaded_at, 1)}
+                for table, entry in self._entries.items()
+            },
+        }
+
+reference_cache = ReferenceDataCache(REFERENCE_CACHE_MAX_AGE)
+
+# Compression and conditional requests
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+def representation_etag(etag: str, encoding: str) -> str:
+    # Each content-coding is a different representation, so it gets its own strong ETag
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') and not etag.startswith("W/") else etag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = re.sub(r'-(gzip|br)"$', '"', etag)
+    return any(re.sub(r'-(gzip|br)"$', '"', tag.strip().removeprefix("W/")) == base
+               for tag in if_none_match.split(","))
+
+def conditional_response(request: Request, entry: ReferenceEntry) -> Response:
+    """304 when the client already has this version, otherwise the (pre-compressed) cached body"""
+    headers = {"Cache-Control": REFERENCE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    encoding = None
+    if len(entry.body) >= COMPRESSION_MIN_SIZE:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    headers["ETag"] = representation_etag(entry.etag, encoding) if encoding else entry.etag
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(content=entry.encoded(encoding), media_type="application/json", headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+async def reference_response(table: str, request: Request) -> Response:
+    entry = await reference_cache.get(table)
+    return conditional_response(request, entry)
+
+class CompressionMiddleware:
+    """Pure ASGI gzip/brotli for complete responses above COMPRESSION_MIN_SIZE.
+    Streamed bodies (more_body) and already-encoded responses pass through untouched."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        pending_start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal pending_start, passthrough
+            if message["type"] == "http.response.start":
+                pending_start = message
+                return
+            if pending_start is None or passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            start, pending_start = pending_start, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body") or len(body) < self.minimum_size or "content-encoding" in headers \
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            compressed = compress_body(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["ETag"] = representation_etag(headers["etag"], encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+# Port lookup index
+class PortIndex:
+    """In-memory port lookup by id, code and name (Russian or English)"""
+
+    def __init__(self, rows: list = (), source=None):
+        self.source = source
+        self.by_id = {}
+        self.by_code = {}
+        self.by_name = {}
+        for row in rows:
+            self.by_id[str(row["id"])] = row
+            if row.get("code"):
+                self.by_code[row["code"].upper()] = row
+            for name in (row.get("name"), row.get("name_en")):
+                if name:
+                    self.by_name.setdefault(name.strip().casefold(), row)
+
+    def lookup(self, value: str):
+        value = str(value)
+        return (
+            self.by_id.get(value)
+            or self.by_code.get(value.upper())
+            or self.by_name.get(value.strip().casefold())
+        )
+
+port_index = PortIndex()
+
+async def get_port_index() -> PortIndex:
+    """Return the port index, rebuilding it whenever the cached ports table was reloaded"""
+    global port_index
+    entry = await reference_cache.get("ports")
+    if port_index.source is not entry:
+        port_index = PortIndex(entry.rows, source=entry)
+    return port_index
+
+# Port typeahead index
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+# Spelling variants that transliteration schemes disagree on (Khabarovsk/Habarovsk, Yekaterinburg/Ekaterinburg)
+LATIN_FOLDS = (("kh", "h"), ("ye", "e"), ("yu", "u"), ("ya", "a"), ("j", "i"), ("y", "i"), ("w", "v"), ("x", "ks"), ("q", "k"))
+
+def normalize_search_text(text: str) -> str:
+    text = str(text or "").casefold().translate(CYRILLIC_TO_LATIN)
+    text = re.sub(r"[^a-z0-9 ]+", " ", text)
+    for variant, canonical in LATIN_FOLDS:
+        text = text.replace(variant, canonical)
+    return " ".join(text.split())
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class PortSuggestIndex:
+    """Prefix (sorted tokens + bisect) and trigram index over port name, name_en, code and city"""
+
+    FIELDS = ("name", "name_en", "code", "city")
+
+    def __init__(self, rows: list, source=None):
+        self.source = source
+        self.rows = rows
+        self.by_code = {}
+        tokens = set()
+        self.trigram_index = {}
+        for position, row in enumerate(rows):
+            if row.get("code"):
+                self.by_code[row["code"].strip().upper()] = position
+            for field in self.FIELDS:
+                term = normalize_search_text(row.get(field))
+                if not term:
+                    continue
+                tokens.add((term, 0, position))  # whole-term prefix ranks above word prefix
+                for word in term.split()[1:]:
+                    tokens.add((word, 1, position))
+                for gram in trigrams(term):
+                    self.trigram_index.setdefault(gram, set()).add(position)
+        self.tokens = sorted(tokens)
+
+    def suggest(self, query: str, limit: int = 10) -> list:
+        normalized = normalize_search_text(query)
+        if not normalized:
+            return []
+        scores = {}
+        code_match = self.by_code.get(query.strip().upper())
+        if code_match is not None:
+            scores[code_match] = 100.0
+        start = bisect_left(self.tokens, (normalized,))
+        for token, kind, position in self.tokens[start:]:
+            if not token.startswith(normalized):
+                break
+            score = 80.0 if kind == 0 else 60.0
+            if token == normalized:
+                score += 10.0
+            scores[position] = max(scores.get(position, 0.0), score)
+        if len(scores) < limit and len(normalized) >= 3:
+            # Fuzzy fallback for typos and transliteration variants
+            query_grams = trigrams(normalized)
+            shared = {}
+            for gram in query_grams:
+                for position in self.trigram_index.get(gram, ()):
+                    shared[position] = shared.get(position, 0) + 1
+            for position, count in shared.items():
+                similarity = count / len(query_grams)
+                if similarity >= 0.4:
+                    scores[position] = max(scores.get(position, 0.0), 50.0 * similarity)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], len(self.rows[item[0]].get("name") or "")))
+        return [
+            {field: self.rows[position].get(field) for field in ("id", "name", "name_en", "code", "city", "country")}
+            | {"score": round(score, 1)}
+            for position, score in ranked[:limit]
+        ]
+
+port_suggest_index = PortSuggestIndex([])
+
+async def get_port_suggest_index() -> PortSuggestIndex:
+    global port_suggest_index
+    entry = await reference_cache.get("ports")
+    if port_suggest_index.source is not entry:
+        port_suggest_index = PortSuggestIndex(entry.rows, source=entry)
+    return port_suggest_index
+
+async def resolve_ports(values) -> dict:
+    """Map port ids/codes/names to port rows; index misses are fetched in one batched query"""
+    index = await get_port_index()
+    resolved = {}
+    missing = []
+    for value in values:
+        row = index.lookup(value)
+        if row is not None:
+            resolved[value] = row
+        elif value not in missing:
+            missing.append(value)
+    if missing:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch('SELECT * FROM ports WHERE id = ANY($1)', missing)
+        for row in rows:
+            resolved[row["id"]] = dict(row)
+    return resolved
+
+def webhook_port_name(value: str, ports: dict) -> str:
+    # Use English name from database, fallback to original value if not found
+    row = ports.get(value)
+    return row["name_en"] if row and row.get("name_en") else value
+
+async def get_search_webhook_url() -> str:
+    entry = await reference_cache.get("webhook_settings")
+    return entry.rows[0]["webhook_url"] if entry.rows else f"{N8N_WEBHOOK_BASE}/search"
+
+# Cross-worker cache invalidation via LISTEN/NOTIFY
+graph_refresh_tasks = set()
+
+def apply_invalidation(payload: str):
+    """Drop local caches named in a comma-separated NOTIFY payload ("*" means everything)"""
+    global route_graph
+    names = [name for name in payload.split(",") if name]
+    if "*" in names or "route_graph" in names:
+        route_graph = None
+    if "*" in names:
+        reference_cache.invalidate()
+        token_cache.clear()
+        user_cache.clear()
+        return
+    for name in names:
+        if name.startswith("user:"):
+            invalidate_user(name[len("user:"):])
+        elif name.startswith("route:"):
+            task = asyncio.create_task(refresh_graph_route(name[len("route:"):]))
+            graph_refresh_tasks.add(task)
+            task.add_done_callback(graph_refresh_tasks.discard)
+    tables = [name for name in names if name in REFERENCE_QUERIES]
+    if tables:
+        reference_cache.invalidate(*tables)
+
+async def publish_invalidation(conn, *names: str) -> str:
+    """Notify every worker (delivered on commit) and invalidate this worker's caches.
+    Inside a transaction the caller must apply_invalidation() the returned payload after commit:
+    doing it earlier lets a concurrent reload cache the pre-commit data under the new generation."""
+    payload = ",".join(names) or "*"
+    await conn.execute('SELECT pg_notify($1, $2)', CACHE_INVALIDATION_CHANNEL, payload)
+    if not conn.is_in_transaction():
+        apply_invalidation(payload)
+    return payload
+
+def on_invalidation_notify(connection, pid, channel, payload):
+    logging.info(f"🔄 Cache invalidation from backend {pid}: {payload}")
+    apply_invalidation(payload)
+
+async def listen_for_invalidations():
+    """Hold one dedicated LISTEN connection (outside db_pool), reconnecting when it drops"""
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_LISTEN_URL, statement_cache_size=0)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda c: lost.set())
+            await conn.add_listener(CACHE_INVALIDATION_CHANNEL, on_invalidation_notify)
+            # Notifications sent while we were disconnected are lost, so start clean
+            apply_invalidation("*")
+            logging.info(f"👂 Listening for cache invalidations on '{CACHE_INVALIDATION_CHANNEL}'")
+            delay = 1
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=LISTENER_HEALTHCHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    # A silent network drop is only noticed when we talk to the server
+                    await conn.execute('SELECT 1')
+            logging.warning("⚠️ Cache invalidation listener connection lost")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"⚠️ Cache invalidation listener error: {e}")
+        finally:
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+# List columns that used to be stored as JSON text
+JSONB_COLUMNS = (
+    ("cargo_types", "special_requirements"),
+    ("ports", "transport_types"),
+    ("shipping_routes", "available_container_types"),
+)
+
+def jsonb_migration(table: str, column: str) -> str:
+    # No-op once the column is JSONB (or if the table is not there yet)
+    return f"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = '{table}'
+              AND column_name = '{column}' AND data_type <> 'jsonb'
+        ) THEN
+            ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT;
+            ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING NULLIF({column}::text, '')::jsonb;
+            ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT '[]'::jsonb;
+        END IF;
+    END
+    $$
+    """
+
+# Schema for tables owned by the API itself
+SCHEMA_STATEMENTS = [
+    *(jsonb_migration(table, column) for table, column in JSONB_COLUMNS),
+    """
+    CREATE TABLE IF NOT EXISTS booking_outbox (
+        id TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        delivered_at TIMESTAMPTZ
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_booking_outbox_due ON booking_outbox (next_attempt_at) WHERE status = 'pending'",
+    """
+    CREATE TABLE IF NOT EXISTS search_providers (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        webhook_url TEXT NOT NULL,
+        enabled BOOLEAN NOT NULL DEFAULT TRUE,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Any change to users (from the API or elsewhere) drops cached tokens/users in every worker
+    f"""
+    CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CACHE_INVALIDATION_CHANNEL}', 'user:' || OLD.id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Created once: DROP/CREATE on every start would take an ACCESS EXCLUSIVE lock on users each deploy
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'users_cache_invalidation' AND tgrelid = 'users'::regclass
+        ) THEN
+            CREATE TRIGGER users_cache_invalidation
+            AFTER UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_user_changed();
+        END IF;
+    END
+    $$
+    """,
+    # Keyset pagination order for /admin/routes, plus one index per filter with the same tail
+    "CREATE INDEX IF NOT EXISTS idx_shipping_routes_keyset ON shipping_routes (origin_port, destination_port, id)",
+    "CREATE INDEX IF NOT EXISTS idx_shipping_routes_destination ON shipping_routes (destination_port, origin_port, id)",
+    "CREATE INDEX IF NOT EXISTS idx_shipping_routes_carrier ON shipping_routes (carrier, origin_port, destination_port, id)",
+    "CREATE INDEX IF NOT EXISTS idx_shipping_routes_transport ON shipping_routes (transport_type, origin_port, destination_port, id)",
+]
+SCHEMA_LOCK_ID = 724100
+
+async def ensure_schema():
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Workers start concurrently; only one applies the schema at a time
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', SCHEMA_LOCK_ID)
+            for statement in SCHEMA_STATEMENTS:
+                await conn.execute(statement)
+
+# Booking outbox: bookings are stored first and delivered to n8n in the background
+booking_outbox_wakeup = asyncio.Event()
+
+async def claim_due_bookings(limit: int) -> list:
+    """Lease up to `limit` due bookings; SKIP LOCKED keeps workers from claiming the same row"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            UPDATE booking_outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = NOW() + make_interval(secs => $2)
+            WHERE id IN (
+                SELECT id FROM booking_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, payload, attempts, created_at
+        """, limit, BOOKING_OUTBOX_LEASE_SECONDS)
+
+async def deliver_outbox_booking(row):
+    url = f"{N8N_WEBHOOK_BASE}/logistics/application-get"
+    try:
+        response = await webhook_request("booking", "POST", url, content=row["payload"],
+                                         headers={"Content-Type": "application/json"})
+        if response.status_code != 200:
+            raise Exception(f"Webhook returned status {response.status_code}")
+    except Exception as e:
+        await fail_outbox_booking(row, str(e))
+        return
+
+    logging.info(f"📦 Booking {row['id']} delivered on attempt {row['attempts']}")
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE booking_outbox SET status = 'delivered', delivered_at = NOW(), last_error = NULL
+            WHERE id = $1
+        """, row["id"])
+
+async def fail_outbox_booking(row, error: str):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if row["attempts"] >= BOOKING_OUTBOX_MAX_ATTEMPTS:
+            logging.error(f"❌ Booking {row['id']} moved to dead letter after {row['attempts']} attempts: {error}")
+            await conn.execute("""
+                UPDATE booking_outbox SET status = 'dead', last_error = $2 WHERE id = $1
+            """, row["id"], error)
+            return
+        # Exponential backoff with jitter
+        delay = min(BOOKING_OUTBOX_BACKOFF_BASE * 2 ** (row["attempts"] - 1), BOOKING_OUTBOX_BACKOFF_MAX)
+        delay *= random.uniform(0.5, 1.0)
+        logging.warning(f"⚠️ Booking {row['id']} delivery failed (attempt {row['attempts']}), retry in {delay:.0f}s: {error}")
+        await conn.execute("""
+            UPDATE booking_outbox SET next_attempt_at = NOW() + make_interval(secs => $2), last_error = $3
+            WHERE id = $1
+        """, row["id"], delay, error)
+
+async def run_booking_dispatcher():
+    """Deliver outbox bookings with at most BOOKING_OUTBOX_CONCURRENCY requests in flight"""
+    in_flight = set()
+
+    def delivery_done(task):
+        in_flight.discard(task)
+        booking_outbox_wakeup.set()
+
+    try:
+        while True:
+            booking_outbox_wakeup.clear()
+            free = BOOKING_OUTBOX_CONCURRENCY - len(in_flight)
+            claimed = 0
+            if free > 0:
+                try:
+                    for row in await claim_due_bookings(free):
+                        task = asyncio.create_task(deliver_outbox_booking(row))
+                        in_flight.add(task)
+                        task.add_done_callback(delivery_done)
+                        claimed += 1
+                except Exception as e:
+                    logging.error(f"❌ Booking outbox claim failed: {e}")
+            if claimed and claimed == free:
+                # Every slot was filled, there may be more due rows
+                continue
+            try:
+                await asyncio.wait_for(booking_outbox_wakeup.wait(), timeout=BOOKING_OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # Unsettled rows stay pending and are retried once their lease expires
+        for task in in_flight:
+            task.cancel()
+
+# Click analytics write buffer
+class ClickBuffer:
+    """Collects calculate_clicks rows in memory and writes them with COPY in batches"""
+
+    def __init__(self, flush_size: int, flush_interval: float, max_pending: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, route_id: str, user_id: str):
+        if len(self._pending) >= self.max_pending:
+            # Database unavailable for too long: drop the oldest click rather than grow without bound
+            self._pending.pop(0)
+            self.dropped += 1
+        self._pending.append((route_id, user_id, datetime.now(timezone.utc)))
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                pool = await get_db_pool()
+                async with pool.acquire() as conn:
+                    await conn.copy_records_to_table(
+                        'calculate_clicks',
+                        records=batch,
+                        columns=['rout_id', 'user_id', 'created_at'],
+                    )
+                self.flushed += len(batch)
+                self.flushes += 1
+            except asyncio.CancelledError:
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                self.failures += 1
+                self._requeue(batch)
+                logging.error(f"❌ Click buffer flush failed ({len(batch)} clicks kept): {e}")
+
+    def _requeue(self, batch: list):
+        # Put the batch back in front of newer clicks, keeping the newest within the cap
+        merged = batch + self._pending
+        self.dropped += max(len(merged) - self.max_pending, 0)
+        self._pending = merged[-self.max_pending:]
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                # Cancellation (shutdown) must not abort a COPY half-way; the final flush waits for it
+                await asyncio.shield(self.flush())
+        finally:
+            await self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "flush_size": self.flush_size,
+            "flush_interval_seconds": self.flush_interval,
+            "max_pending": self.max_pending,
+        }
+
+click_buffer = ClickBuffer(CLICK_BUFFER_FLUSH_SIZE, CLICK_BUFFER_FLUSH_INTERVAL, CLICK_BUFFER_MAX_PENDING)
+
+# Table-driven fallback pricing over shipping_routes
+DANGEROUS_CARGO_MARKUP = 1.3  # 30% markup for dangerous cargo
+VOLUME_DISCOUNT = 0.95  # 5% discount for multiple containers
+
+class FallbackPricingEngine:
+    """Columnar (NumPy) view of shipping_routes priced in one vectorized pass per lane"""
+
+    def __init__(self, routes: list, container_types: list, ports: PortIndex, sources=()):
+        self.sources = sources
+        self.routes = routes
+        self.port_index = ports
+
+        # Container types: column j of the availability matrix; matched by name or size
+        self.container_index = {}
+        for j, container in enumerate(container_types):
+            for key in (container.get("name"), container.get("size")):
+                if key:
+                    self.container_index.setdefault(key.strip().casefold(), j)
+        self.price_modifier = np.array(
+            [float(container.get("price_modifier") or 1.0) for container in container_types] or [1.0],
+            dtype=np.float64,
+        )
+
+        count = len(routes)
+        self.base_price = np.array([float(route["base_price_usd"] or 0) for route in routes], dtype=np.float64)
+        self.transit_days = np.array([int(route["transit_time_days"] or 0) for route in routes], dtype=np.int32)
+        self.availability = np.zeros((count, max(len(container_types), 1)), dtype=bool)
+        lanes = {}
+        for i, route in enumerate(routes):
+            available = route.get("available_container_types") or []
+            columns = [self.container_index.get(str(name).strip().casefold()) for name in available]
+            columns = [j for j in columns if j is not None]
+            if columns:
+                self.availability[i, columns] = True
+            else:
+                # No container restriction recorded for this route
+                self.availability[i, :] = True
+            lane = (self.port_key(route["origin_port"]), self.port_key(route["destination_port"]))
+            lanes.setdefault(lane, []).append(i)
+        self.lanes = {lane: np.array(indices, dtype=np.int64) for lane, indices in lanes.items()}
+
+    def port_key(self, value) -> str:
+        """Routes may store port codes, names or ids; normalize them all to the port id"""
+        row = self.port_index.lookup(value)
+        return str(row["id"]) if row else str(value).strip().upper()
+
+    def quote(self, origin, destination, container_type: str, is_dangerous_cargo: bool, containers_count: int):
+        """Return (route indices, prices) for a lane, cheapest first"""
+        indices = self.lanes.get((self.port_key(origin), self.port_key(destination)))
+        if indices is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        column = self.container_index.get(str(container_type).strip().casefold())
+        modifier = 1.0
+        if column is not None:
+            indices = indices[self.availability[indices, column]]
+            modifier = self.price_modifier[column]
+        prices = self.base_price[indices] * modifier
+        if is_dangerous_cargo:
+            prices = np.floor(prices * DANGEROUS_CARGO_MARKUP)
+        if containers_count > 1:
+            prices = np.floor(prices * VOLUME_DISCOUNT * containers_count)
+        order = np.argsort(prices, kind="stable")
+        return indices[order], prices[order]
+
+pricing_engine = None
+
+async def get_pricing_engine() -> FallbackPricingEngine:
+    """Return the pricing engine, rebuilding it when routes, container types or ports were reloaded"""
+    global pricing_engine
+    routes = await reference_cache.get("shipping_routes")
+    containers = await reference_cache.get("container_types")
+    ports = await get_port_index()
+    sources = (routes, containers, ports)
+    if pricing_engine is None or any(a is not b for a, b in zip(pricing_engine.sources, sources)):
+        pricing_engine = FallbackPricingEngine(routes.rows, containers.rows, ports, sources)
+    return pricing_engine
+
+# Departure schedule index
+FREQUENCY_PERIODS = {
+    "daily": 1, "ежедневно": 1,
+    "weekly": 7, "еженедельно": 7, "раз в неделю": 7,
+    "biweekly": 14, "every 2 weeks": 14, "раз в 2 недели": 14,
+    "monthly": 30, "ежемесячно": 30, "раз в месяц": 30,
+}
+TIMES_PER_WEEK = re.compile(r"(\d+)\s*(?:x|times|раз[а]?)\b.*(?:week|недел)")
+SCHEDULE_EPOCH = date(2024, 1, 1)
+
+def parse_frequency(frequency: Optional[str]):
+    """Return (period_days, offsets within the period) for a free-text route frequency"""
+    text = (frequency or "").strip().casefold()
+    if text in FREQUENCY_PERIODS:
+        return FREQUENCY_PERIODS[text], [0]
+    match = TIMES_PER_WEEK.search(text)
+    if match:
+        per_week = min(max(int(match.group(1)), 1), 7)
+        return 7, sorted({round(i * 7 / per_week) for i in range(per_week)})
+    return 7, [0]  # Unknown frequency: assume weekly
+
+class ScheduleIndex:
+    """Per-route sorted arrays of departure day ordinals, so a date window is two binary searches"""
+
+    def __init__(self, engine: FallbackPricingEngine):
+        self.engine = engine
+        self.built_for = date.today()
+        start = self.built_for.toordinal() - SCHEDULE_BOOKING_CUTOFF_DAYS
+        end = self.built_for.toordinal() + SCHEDULE_HORIZON_DAYS
+        self.departures = []
+        for route in engine.routes:
+            period, offsets = parse_frequency(route.get("frequency"))
+            created_at = route.get("created_at")
+            anchor = (created_at.date() if isinstance(created_at, datetime) else SCHEDULE_EPOCH).toordinal()
+            days = []
+            for offset in offsets:
+                first = anchor + offset + -(-(start - anchor - offset) // period) * period
+                days.append(np.arange(first, end + 1, period, dtype=np.int32))
+            self.departures.append(np.sort(np.concatenate(days)) if days else np.empty(0, dtype=np.int32))
+
+    def sailings(self, route_index: int, date_from: date, date_to: date) -> list:
+        departures = self.departures[route_index]
+        lo = np.searchsorted(departures, date_from.toordinal(), side="left")
+        hi = np.searchsorted(departures, date_to.toordinal(), side="right")
+        transit = int(self.engine.transit_days[route_index])
+        today = date.today()
+        result = []
+        for ordinal in departures[lo:min(hi, lo + SCHEDULE_MAX_SAILINGS)].tolist():
+            deadline = date.fromordinal(ordinal - SCHEDULE_BOOKING_CUTOFF_DAYS)
+            if deadline < today:
+                continue
+            result.append({
+                "departure_date": date.fromordinal(ordinal).isoformat(),
+                "booking_deadline": deadline.isoformat(),
+                "arrival_date": date.fromordinal(ordinal + transit).isoformat(),
+            })
+        return result
+
+schedule_index = None
+
+async def get_schedule_index() -> ScheduleIndex:
+    """Rebuilt when the pricing engine (i.e. routes) changes or the day rolls over"""
+    global schedule_index
+    engine = await get_pricing_engine()
+    if schedule_index is None or schedule_index.engine is not engine or schedule_index.built_for != date.today():
+        schedule_index = ScheduleIndex(engine)
+    return schedule_index
+
+# Multi-leg route graph
+class RouteGraph:
+    """Directed multigraph of shipping_routes (one edge per route), updated in place on route changes"""
+
+    def __init__(self, routes: list, ports: PortIndex):
+        self.port_index = ports
+        self.adjacency = {}  # port key -> [edge ids]
+        self.reverse_adjacency = {}
+        self.edge_source = []
+        self.edge_target = []
+        self.edge_price = []
+        self.edge_transit = []
+        self.edge_route = []
+        self.edge_containers = []
+        self.edge_by_route = {}  # route id -> edge id
+        for route in routes:
+            self.upsert_route(route)
+
+    def port_key(self, value) -> str:
+        row = self.port_index.lookup(value)
+        return str(row["id"]) if row else str(value).strip().upper()
+
+    def upsert_route(self, route: dict):
+        self.remove_route(str(route["id"]))
+        edge = len(self.edge_route)
+        source = self.port_key(route["origin_port"])
+        target = self.port_key(route["destination_port"])
+        available = route.get("available_container_types") or []
+        if isinstance(available, str):
+            available = json.loads(available)
+        self.edge_source.append(source)
+        self.edge_target.append(target)
+        self.edge_price.append(float(route["base_price_usd"] or 0))
+        self.edge_transit.append(int(route["transit_time_days"] or 0))
+        self.edge_route.append(route)
+        self.edge_containers.append({str(name).strip().casefold() for name in available})
+        self.edge_by_route[str(route["id"])] = edge
+        self.adjacency.setdefault(source, []).append(edge)
+        self.reverse_adjacency.setdefault(target, []).append(edge)
+
+    def remove_route(self, route_id: str):
+        edge = self.edge_by_route.pop(route_id, None)
+        if edge is None:
+            return
+        # Edge slots are left as tombstones; only adjacency lists drop them
+        self.adjacency[self.edge_source[edge]].remove(edge)
+        self.reverse_adjacency[self.edge_target[edge]].remove(edge)
+
+    def _edge_allowed(self, edge: int, container_type: Optional[str]) -> bool:
+        if not container_type or not self.edge_containers[edge]:
+            return True
+        return container_type.strip().casefold() in self.edge_containers[edge]
+
+    def _weight(self, edge: int, sort_by: str) -> float:
+        return self.edge_price[edge] if sort_by == "price" else float(self.edge_transit[edge])
+
+    def _bounds_to(self, target: str, sort_by: str, container_type: Optional[str]):
+        """Cheapest cost (reverse Dijkstra) and fewest hops (reverse BFS) from every port to target"""
+        cost = {target: 0.0}
+        heap = [(0.0, target)]
+        while heap:
+            node_cost, node = heapq.heappop(heap)
+            if node_cost > cost.get(node, float("inf")):
+                continue
+            for edge in self.reverse_adjacency.get(node, ()):
+                if not self._edge_allowed(edge, container_type):
+                    continue
+                source = self.edge_source[edge]
+                new_cost = node_cost + self._weight(edge, sort_by)
+                if new_cost < cost.get(source, float("inf")):
+                    cost[source] = new_cost
+                    heapq.heappush(heap, (new_cost, source))
+        # The cheapest path is not necessarily the shortest, so hop counts need their own unweighted pass
+        hops = {target: 0}
+        queue = deque([target])
+        while queue:
+            node = queue.popleft()
+            for edge in self.reverse_adjacency.get(node, ()):
+                source = self.edge_source[edge]
+                if source not in hops and self._edge_allowed(edge, container_type):
+                    hops[source] = hops[node] + 1
+                    queue.append(source)
+        return cost, hops
+
+    def k_best(self, origin, destination, k: int, max_hops: int, sort_by: str = "price",
+               container_type: Optional[str] = None) -> list:
+        """k cheapest (or fastest) simple itineraries with at most max_hops legs.
+
+        Best-first search over partial paths ordered by cost so far plus the exact remaining
+        lower bound from the reverse Dijkstra, so complete itineraries come out in cost order
+        and branches that cannot reach the destination within the hop limit are never expanded.
+        """
+        source = self.port_key(origin)
+        target = self.port_key(destination)
+        lower_bound, min_hops = self._bounds_to(target, sort_by, container_type)
+        if source not in lower_bound or source == target:
+            return []
+        transfer_cost = ROUTE_TRANSFER_DAYS if sort_by == "transit_time" else 0
+        counter = 0  # tie-breaker so heap entries never compare paths
+        heap = [(lower_bound[source], counter, 0.0, source, ())]
+        itineraries = []
+        while heap and len(itineraries) < k:
+            _, _, cost, node, path = heapq.heappop(heap)
+            if node == target:
+                itineraries.append(path)
+                continue
+            visited = {self.edge_source[edge] for edge in path} | {node}
+            for edge in self.adjacency.get(node, ()):
+                next_node = self.edge_target[edge]
+                if next_node in visited or next_node not in lower_bound:
+                    continue
+                if len(path) + 1 + min_hops[next_node] > max_hops or not self._edge_allowed(edge, container_type):
+                    continue
+                new_cost = cost + self._weight(edge, sort_by) + (transfer_cost if path else 0)
+                counter += 1
+                heapq.heappush(heap, (new_cost + lower_bound[next_node], counter, new_cost, next_node, path + (edge,)))
+        return [self.describe(path) for path in itineraries]
+
+    def describe(self, path: tuple) -> dict:
+        legs = []
+        for edge in path:
+            route = self.edge_route[edge]
+            origin = self.port_index.lookup(route["origin_port"])
+            destination = self.port_index.lookup(route["destination_port"])
+            legs.append({
+                "route_id": str(route["id"]),
+                "origin_port": origin["name"] if origin else route["origin_port"],
+                "destination_port": destination["name"] if destination else route["destination_port"],
+                "carrier": route["carrier"],
+                "transport_type": route.get("transport_type"),
+                "transit_time_days": self.edge_transit[edge],
+                "price_usd": self.edge_price[edge],
+            })
+        return {
+            "legs": legs,
+            "hops": len(legs),
+            "total_price_usd": sum(leg["price_usd"] for leg in legs),
+            "total_transit_days": sum(leg["transit_time_days"] for leg in legs) + ROUTE_TRANSFER_DAYS * (len(legs) - 1),
+        }
+
+route_graph = None
+
+async def get_route_graph() -> RouteGraph:
+    global route_graph
+    if route_graph is None:
+        routes = await reference_cache.get("shipping_routes")
+        route_graph = RouteGraph(routes.rows, await get_port_index())
+    return route_graph
+
+async def refresh_graph_route(route_id: str):
+    """Apply one added/changed/deleted route to the graph without rebuilding it"""
+    if route_graph is None:
+        return
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow('SELECT * FROM shipping_routes WHERE id = $1', route_id)
+    if route_graph is None:
+        return
+    if row is None:
+        route_graph.remove_route(route_id)
+    else:
+        route_graph.upsert_route(dict(row))
+
 # Initialize default data
 @app.on_event("startup")
 async def startup_event():
+    global cache_listener_task, booking_dispatcher_task, click_flusher_task
     await get_db_pool()
+    await get_http_client()
+    await ensure_schema()
+    booking_dispatcher_task = asyncio.create_task(run_booking_dispatcher())
+    click_flusher_task = asyncio.create_task(click_buffer.run())
+    if CACHE_INVALIDATION_LISTENER:
+        cache_listener_task = asyncio.create_task(listen_for_invalidations())
     # Initialize database
     # await init_database()
     # Always refresh data for development
     # await refresh_sample_data()
-    
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    global http_client, db_pool, cache_listener_task, booking_dispatcher_task, click_flusher_task
+    if cache_listener_task is not None:
+        cache_listener_task.cancel()
+        cache_listener_task = None
+    if booking_dispatcher_task is not None:
+        booking_dispatcher_task.cancel()
+        booking_dispatcher_task = None
+    if click_flusher_task is not None:
+        # The flusher writes out pending clicks when cancelled
+        click_flusher_task.cancel()
+        await asyncio.gather(click_flusher_task, return_exceptions=True)
+        click_flusher_task = None
+    password_hasher.shutdown()
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
 
 
 # CORS middleware
@@ -244,8 +1812,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# Response compression (outermost, so CORS headers are set before the body is compressed)
+app.add_middleware(CompressionMiddleware)
+
 # Health check endpoint
 @api_router.get("/")
 async def health_check():
@@ -253,202 +1825,741 @@ async def health_check():
 
 # Container types endpoint
 @api_router.get("/container-types")
-async def get_container_types():
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT * FROM container_types')
-        return [dict(row) for row in rows]
+async def get_container_types(request: Request):
+    return await reference_response("container_types", request)
 
 # Cargo types endpoint  
 @api_router.get("/cargo-types")
-async def get_cargo_types():
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT * FROM cargo_types')
-        results = []
-        for row in rows:
-            row_dict = dict(row)
-            # Parse JSON special_requirements
-            if row_dict['special_requirements']:
-                row_dict['special_requirements'] = json.loads(row_dict['special_requirements'])
-            results.append(row_dict)
-        return results
+async def get_cargo_types(request: Request):
+    return await reference_response("cargo_types", request)
 
 # Ports endpoint
 @api_router.get("/ports")
-async def get_ports():
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT * FROM ports ORDER BY name')
-        results = []
-        for row in rows:
-            row_dict = dict(row)
-            # Parse JSON transport_types
-            if row_dict['transport_types']:
-                row_dict['transport_types'] = json.loads(row_dict['transport_types'])
-            results.append(row_dict)
-        return results
+async def get_ports(request: Request):
+    return await reference_response("ports", request)
+
+# Port typeahead
+@api_router.get("/ports/suggest")
+async def suggest_ports(q: str = "", limit: int = Query(10, ge=1, le=50)):
+    index = await get_port_suggest_index()
+    return index.suggest(q, limit)
 
 # Search endpoint
-@api_router.post("/search")
-async def search_shipments(query: SearchQuery):
-    print(f"🔍 DEBUG: Received search query: {query}")
-    
-    # Get webhook settings
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        webhook_row = await conn.fetchrow('SELECT webhook_url FROM webhook_settings LIMIT 1')
-        webhook_url = webhook_row['webhook_url'] if webhook_row else f"{N8N_WEBHOOK_BASE}/search"
-    
-    # Convert our data format to webhook API format
-    # Map container type to size number
-    container_size_map = {
-        "20ft": "20",
-        "40ft": "40"
-    }
-    
-    # Convert port IDs to English names for webhook API
-    # Find port info by id to get English name (name_en)
-    async with pool.acquire() as conn:
-        origin_port_row = await conn.fetchrow('SELECT * FROM ports WHERE id = $1', query.origin_port)
-        dest_port_row = await conn.fetchrow('SELECT * FROM ports WHERE id = $1', query.destination_port)
-    
-    # Use English name from database, fallback to original value if not found
-    webhook_from = origin_port_row['name_en'] if origin_port_row and origin_port_row['name_en'] else query.origin_port
-    webhook_to = dest_port_row['name_en'] if dest_port_row and dest_port_row['name_en'] else query.destination_port
-    
-    webhook_params = {
-        "from": webhook_from,  # Send English name (name_en) for webhook
-        "to": webhook_to,  # Send English name (name_en) for webhook  
-        "container_size": container_size_map.get(query.container_type, "40"),
+# Map container type to size number for the webhook API
+CONTAINER_SIZE_MAP = {
+    "20ft": "20",
+    "40ft": "40"
+}
+
+# Optional fields copied from webhook items as-is; missing ones fall back to query values
+WEBHOOK_QUOTE_FIELDS = ("origin_port", "destination_port", "carrier", "departure_date_range", "container_type")
+
+# Circuit breaker for search webhooks
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """closed -> open on high failure/slow-call rate; open -> half_open after a cool-down;
+    half_open -> closed after CIRCUIT_HALF_OPEN_CALLS good trial calls, or back to open on any bad one"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._window = deque(maxlen=CIRCUIT_WINDOW_SIZE)  # (failed, slow) per call
+        self._trial_in_flight = 0
+        self._trial_successes = 0
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self._trial_in_flight = 0
+            self._trial_successes = 0
+        if self.state == "half_open":
+            if self._trial_in_flight >= CIRCUIT_HALF_OPEN_CALLS:
+                self.rejected += 1
+                return False
+            self._trial_in_flight += 1
+        return True
+
+    def record(self, failed: bool, duration: float):
+        slow = duration >= CIRCUIT_SLOW_CALL_SECONDS
+        if self.state == "half_open":
+            self._trial_in_flight -= 1
+            if failed or slow:
+                self._trip()
+                return
+            self._trial_successes += 1
+            if self._trial_successes >= CIRCUIT_HALF_OPEN_CALLS:
+                self.state = "closed"
+                self._window.clear()
+                logging.info(f"✅ Circuit for {self.name} closed")
+            return
+        if self.state != "closed":
+            return
+        self._window.append((failed, slow))
+        if len(self._window) < CIRCUIT_MIN_CALLS:
+            return
+        failure_rate, slow_rate = self._rates()
+        if failure_rate >= CIRCUIT_FAILURE_RATE_THRESHOLD or slow_rate >= CIRCUIT_SLOW_CALL_RATE_THRESHOLD:
+            self._trip()
+
+    def _rates(self):
+        calls = len(self._window)
+        if not calls:
+            return 0.0, 0.0
+        return (sum(1 for failed, _ in self._window if failed) / calls,
+                sum(1 for _, slow in self._window if slow) / calls)
+
+    def _trip(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._window.clear()
+        self.opens += 1
+        logging.warning(f"⚠️ Circuit for {self.name} opened for {CIRCUIT_OPEN_SECONDS}s")
+
+    def stats(self):
+        failure_rate, slow_rate = self._rates()
+        return {
+            "state": self.state,
+            "window_calls": len(self._window),
+            "failure_rate": round(failure_rate, 3),
+            "slow_call_rate": round(slow_rate, 3),
+            "opens": self.opens,
+            "rejected": self.rejected,
+            "open_remaining_seconds": round(max(CIRCUIT_OPEN_SECONDS - (time.monotonic() - self.opened_at), 0), 1)
+            if self.state == "open" else 0,
+        }
+
+circuit_breakers = {}  # webhook URL -> CircuitBreaker
+
+def get_circuit_breaker(webhook_url: str) -> CircuitBreaker:
+    breaker = circuit_breakers.get(webhook_url)
+    if breaker is None:
+        breaker = circuit_breakers[webhook_url] = CircuitBreaker(webhook_url)
+    return breaker
+
+# Hedged requests for search webhooks
+class HedgePolicy:
+    """Tracks webhook latency and decides when (and whether) to send a hedge request"""
+
+    def __init__(self):
+        self._latencies = deque(maxlen=500)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record_latency(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def delay(self) -> float:
+        if len(self._latencies) < SEARCH_HEDGE_MIN_SAMPLES:
+            return SEARCH_HEDGE_DEFAULT_DELAY
+        latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * SEARCH_HEDGE_PERCENTILE), len(latencies) - 1)
+        return max(latencies[index], SEARCH_HEDGE_MIN_DELAY)
+
+    def can_hedge(self) -> bool:
+        # Cap extra upstream load at SEARCH_HEDGE_MAX_RATE of primary requests
+        return self.hedges < self.requests * SEARCH_HEDGE_MAX_RATE
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "hedge_win_rate": round(self.hedge_wins / self.hedges, 4) if self.hedges else 0.0,
+            "current_delay_seconds": round(self.delay(), 3),
+            "latency_samples": len(self._latencies),
+        }
+
+hedge_policies = {}  # webhook URL -> HedgePolicy
+
+async def send_search_webhook(webhook_url: str, webhook_params: dict, policy: HedgePolicy):
+    started = time.perf_counter()
+    logging.debug("🌐 Sending to webhook: %s with params: %s", webhook_url, webhook_params)
+    response = await webhook_request("search", "GET", webhook_url, params=webhook_params)
+    logging.debug("📡 Webhook response status: %s", response.status_code)
+    if response.status_code != 200:
+        # If webhook is not available, trigger fallback
+        raise Exception(f"Webhook returned status {response.status_code}")
+    webhook_data = response.json()
+    policy.record_latency(time.perf_counter() - started)
+    return webhook_data
+
+async def hedged_search_webhook(webhook_url: str, webhook_params: dict):
+    """Send a second identical request if the first is slower than the latency percentile; first answer wins"""
+    policy = hedge_policies.setdefault(webhook_url, HedgePolicy())
+    policy.requests += 1
+    if not SEARCH_HEDGING_ENABLED:
+        return await send_search_webhook(webhook_url, webhook_params, policy)
+
+    primary = asyncio.create_task(send_search_webhook(webhook_url, webhook_params, policy))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=policy.delay())
+        if done or not policy.can_hedge():
+            return await primary
+        policy.hedges += 1
+        hedge = asyncio.create_task(send_search_webhook(webhook_url, webhook_params, policy))
+        tasks.add(hedge)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        policy.hedge_wins += 1
+                    return task.result()
+        # Both attempts failed
+        return primary.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def request_search_webhook(webhook_url: str, webhook_params: dict):
+    """GET the search webhook through its circuit breaker and return the decoded JSON body"""
+    breaker = get_circuit_breaker(webhook_url)
+    if not breaker.allow():
+        # Fail fast so the caller can serve fallback pricing immediately
+        raise CircuitOpenError(f"Circuit open for {webhook_url}")
+
+    started = time.perf_counter()
+    try:
+        webhook_data = await hedged_search_webhook(webhook_url, webhook_params)
+    except (Exception, asyncio.CancelledError):
+        breaker.record(True, time.perf_counter() - started)
+        raise
+    breaker.record(False, time.perf_counter() - started)
+    return webhook_data
+
+async def fetch_webhook_quotes(webhook_url: str, webhook_params: dict) -> list:
+    """Call the search webhook and normalize its quotes (without per-request fields)"""
+    webhook_data = await request_search_webhook(webhook_url, webhook_params)
+
+    try:
+        # Lazy formatting: the body is only rendered when debug logging is on
+        logging.debug("📊 Webhook returned: %s", webhook_data)
+
+        quotes = []
+        if "result" in webhook_data and isinstance(webhook_data["result"], list):
+            for item in webhook_data["result"]:
+                quote = {field: item[field] for field in WEBHOOK_QUOTE_FIELDS if field in item}
+                quote["id"] = item.get("id", str(uuid.uuid4()))
+                quote["transit_time_days"] = item.get("transit_time_days") or 15
+                quote["price_from_usd"] = float(item.get("price_from_usd", 0))
+                quotes.append(quote)
+    except Exception as e:
+        logging.error(f"❌ Error processing webhook response: {e}")
+        raise Exception(f"Webhook response processing error: {e}")
+
+    if not quotes:
+        # If no results from webhook, raise exception to trigger fallback
+        raise Exception("No results from webhook")
+    return quotes
+
+def build_search_results(quotes: list, query: SearchQuery) -> list:
+    """Apply per-request fields to normalized (possibly cached) webhook quotes"""
+    departure_date_range = f"{query.departure_date_from.strftime('%d.%m')} - {query.departure_date_to.strftime('%d.%m.%Y')}"
+    return [
+        {
+            "id": quote["id"],
+            "origin_port": quote.get("origin_port", query.origin_port),
+            "destination_port": quote.get("destination_port", query.destination_port),
+            "carrier": quote.get("carrier", "Railway Express"),  # Default carrier
+            "departure_date_range": quote.get("departure_date_range", departure_date_range),
+            "transit_time_days": quote["transit_time_days"],
+            "container_type": quote.get("container_type"),
+            "price_from_usd": quote["price_from_usd"],
+            "is_dangerous_cargo": query.is_dangerous_cargo,
+            "available_containers": 5,
+            "booking_deadline": query.departure_date_from.isoformat(),
+            "webhook_success": True
+        }
+        for quote in quotes
+    ]
+
+async def build_fallback_results(query: SearchQuery) -> list:
+    """Quotes from shipping_routes for the requested lane, or mock quotes if the lane is unknown"""
+    try:
+        engine = await get_pricing_engine()
+    except Exception as e:
+        logging.warning(f"⚠️ Pricing engine unavailable, using mock results: {e}")
+        return build_mock_results(query)
+
+    indices, prices = engine.quote(query.origin_port, query.destination_port, query.container_type,
+                                   query.is_dangerous_cargo, query.containers_count)
+    if not len(indices):
+        return build_mock_results(query)
+
+    schedules = await get_schedule_index()
+    departure_date_range = f"{query.departure_date_from.strftime('%d.%m')} - {query.departure_date_to.strftime('%d.%m.%Y')}"
+    results = []
+    for i, price in zip(indices.tolist(), prices.tolist()):
+        route = engine.routes[i]
+        origin = engine.port_index.lookup(route["origin_port"])
+        destination = engine.port_index.lookup(route["destination_port"])
+        sailings = schedules.sailings(i, query.departure_date_from, query.departure_date_to)
+        result = {
+            "id": str(route["id"]),
+            "origin_port": origin["name"] if origin else route["origin_port"],
+            "destination_port": destination["name"] if destination else route["destination_port"],
+            "carrier": route["carrier"],
+            "departure_date_range": departure_date_range,
+            "transit_time_days": int(engine.transit_days[i]),
+            "container_type": query.container_type,
+            "price_from_usd": float(price),
+            "is_dangerous_cargo": query.is_dangerous_cargo,
+            "available_containers": 5,
+            "booking_deadline": query.departure_date_from.isoformat(),
+            "departure_dates": [sailing["departure_date"] for sailing in sailings],
+            "webhook_error": "Тарифы из базы маршрутов (webhook недоступен)"
+        }
+        if sailings:
+            # Actual sailings from the route frequency instead of echoing the requested window
+            first = date.fromisoformat(sailings[0]["departure_date"])
+            last = date.fromisoformat(sailings[-1]["departure_date"])
+            result["departure_date_range"] = f"{first.strftime('%d.%m')} - {last.strftime('%d.%m.%Y')}"
+            result["delivery_date_range"] = f"{date.fromisoformat(sailings[0]['arrival_date']).strftime('%d.%m')} - {date.fromisoformat(sailings[-1]['arrival_date']).strftime('%d.%m.%Y')}"
+            result["booking_deadline"] = sailings[0]["booking_deadline"]
+        results.append(result)
+    return results
+
+# Marks mock quotes: they are placeholders for the UI, not prices for the requested lane
+MOCK_RESULTS_NOTE = "Тестовые данные (webhook недоступен)"
+
+def build_mock_results(query: SearchQuery) -> list:
+    """Mock quotes used when neither the webhook nor shipping_routes can price the lane"""
+    fallback_results = []
+
+    # Generate different routes based on popular railway directions
+    routes_data = [
+        {"origin_port": "Ухань", "destination_port": "Москва", "carrier": "China Railways Express", "base_price": 1000, "transit_days": 15, "route_desc": "Популярный маршрут"},
+        {"origin_port": "Пекин", "destination_port": "Минск", "carrier": "New Silk Road Express", "base_price": 1001, "transit_days": 18, "route_desc": "Прямое сообщение"},
+        {"origin_port": "Актау", "destination_port": "Москва", "carrier": "RZD Logistics", "base_price": 1010, "transit_days": 12, "route_desc": "Быстрая доставка"}
+    ]
+
+    for i, route in enumerate(routes_data):
+        # Add price variation for dangerous cargo
+        price = route["base_price"]
+        if query.is_dangerous_cargo:
+            price = int(price * DANGEROUS_CARGO_MARKUP)
+
+        # Add volume discount for multiple containers
+        if query.containers_count > 1:
+            price = int(price * VOLUME_DISCOUNT * query.containers_count)
+
+        fallback_results.append({
+            "id": str(uuid.uuid4()),
+            "origin_port": route["origin_port"],
+            "destination_port": route["destination_port"],
+            "carrier": route["carrier"],
+            "departure_date_range": f"{query.departure_date_from.strftime('%d.%m')} - {query.departure_date_to.strftime('%d.%m.%Y')}",
+            "transit_time_days": route["transit_days"],
+            "container_type": query.container_type,
+            "price_from_usd": float(price),
+            "is_dangerous_cargo": query.is_dangerous_cargo,
+            "available_containers": 5 + i,
+            "booking_deadline": query.departure_date_from.isoformat(),
+            "webhook_error": MOCK_RESULTS_NOTE
+        })
+
+    return fallback_results
+
+async def load_search_quotes(key: tuple, webhook_url: str, webhook_params: dict) -> list:
+    quotes = await fetch_webhook_quotes(webhook_url, webhook_params)
+    search_cache.set(key, quotes)
+    return quotes
+
+async def get_search_quotes(webhook_url: str, webhook_params: dict) -> list:
+    """Return webhook quotes from the search cache, fetching them on a miss"""
+    key = search_cache_key(webhook_url, webhook_params)
+    cached = search_cache.get(key)
+    if cached is not None:
+        quotes, is_stale = cached
+        if is_stale and key not in search_flight:
+            # stale-while-revalidate: refresh in the background, serve the cached quotes now
+            search_flight.start(key, lambda: load_search_quotes(key, webhook_url, webhook_params))
+        return quotes
+
+    # Concurrent identical searches share one upstream call
+    return await search_flight.do(key, lambda: load_search_quotes(key, webhook_url, webhook_params))
+
+# Multi-provider search fan-out
+provider_stats = {}  # provider id -> counters and latency
+
+async def get_search_providers() -> list:
+    """Enabled search providers; the legacy webhook_settings URL is used when none are registered"""
+    entry = await reference_cache.get("search_providers")
+    if entry.rows:
+        return entry.rows
+    return [{"id": "default", "name": "default", "webhook_url": await get_search_webhook_url()}]
+
+def record_provider_outcome(provider: dict, outcome: str, started: float):
+    stats = provider_stats.setdefault(provider["id"], {
+        "name": provider["name"], "calls": 0, "ok": 0, "error": 0, "timeout": 0,
+        "total_latency_ms": 0.0, "last_latency_ms": None, "last_outcome": None,
+    })
+    latency_ms = round((time.perf_counter() - started) * 1000, 2)
+    stats["calls"] += 1
+    stats[outcome] += 1
+    stats["total_latency_ms"] += latency_ms
+    stats["last_latency_ms"] = latency_ms
+    stats["last_outcome"] = outcome
+
+async def query_provider(provider: dict, webhook_params: dict) -> list:
+    started = time.perf_counter()
+    try:
+        quotes = await get_search_quotes(provider["webhook_url"], webhook_params)
+    except asyncio.CancelledError:
+        # Cancelled by the fan-out deadline; the shared upstream call keeps filling the cache
+        record_provider_outcome(provider, "timeout", started)
+        raise
+    except Exception as e:
+        logging.warning(f"⚠️ Search provider {provider['name']} failed: {e}")
+        record_provider_outcome(provider, "error", started)
+        raise
+    record_provider_outcome(provider, "ok", started)
+    return quotes
+
+def quote_key(quote: dict) -> tuple:
+    """Offers with the same carrier, route and price are duplicates across providers"""
+    return (
+        str(quote.get("carrier", "")).strip().casefold(),
+        quote.get("origin_port"),
+        quote.get("destination_port"),
+        quote["price_from_usd"],
+    )
+
+def merge_quotes(quotes: list) -> list:
+    """Drop duplicate offers and order by price"""
+    merged = {}
+    for quote in quotes:
+        merged.setdefault(quote_key(quote), quote)
+    return sorted(merged.values(), key=lambda quote: quote["price_from_usd"])
+
+async def collect_provider_quotes(webhook_params: dict) -> list:
+    """Query every provider concurrently and merge whatever answered before the deadline"""
+    providers = await get_search_providers()
+    tasks = [asyncio.create_task(query_provider(provider, webhook_params)) for provider in providers]
+    done, pending = await asyncio.wait(tasks, timeout=SEARCH_DEADLINE_SECONDS)
+    for task in pending:
+        task.cancel()
+    quotes = []
+    for task in done:
+        if task.exception() is None:
+            quotes.extend(task.result())
+    if not quotes:
+        raise Exception(f"No results from {len(providers)} provider(s) within {SEARCH_DEADLINE_SECONDS}s")
+    return merge_quotes(quotes)
+
+def build_webhook_params(query: SearchQuery, ports: dict) -> dict:
+    return {
+        "from": webhook_port_name(query.origin_port, ports),  # Send English name (name_en) for webhook
+        "to": webhook_port_name(query.destination_port, ports),  # Send English name (name_en) for webhook  
+        "container_size": CONTAINER_SIZE_MAP.get(query.container_type, "40"),
         # "price": "5100",  # Base price for filtering
         # "ETD": query.departure_date_from.isoformat(),
         "date_from": query.departure_date_from.isoformat(),
         "date_to": query.departure_date_to.isoformat(),
         # "TT": "35"  # Default transit time
     }
-    
-    print(f"🌐 DEBUG: Sending to webhook: {webhook_url} with params: {webhook_params}")
+
+async def execute_search(query: SearchQuery, ports: Optional[dict] = None) -> list:
+    """Provider quotes for the query, or fallback pricing when no provider answers"""
+    if ports is None:
+        # Convert port IDs to English names for webhook API via the in-memory port index
+        ports = await resolve_ports([query.origin_port, query.destination_port])
+    webhook_params = build_webhook_params(query, ports)
     
     try:
-        # Send GET request to webhook with query parameters
-        import httpx
-        async with httpx.AsyncClient() as client:
-            response = await client.get(webhook_url, params=webhook_params, timeout=30)
-            print(f"📡 DEBUG: Webhook response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    webhook_data = response.json()
-                    print(f"📊 DEBUG: Webhook returned: {webhook_data}")
-                    
-                    # Convert webhook format to our format
-                    results = []
-                    if "result" in webhook_data and isinstance(webhook_data["result"], list):
-                        for item in webhook_data["result"]:
-                            # Convert webhook result to our SearchResult format
-                            result = {
-                                "id": item.get("id", str(uuid.uuid4())),
-                                "origin_port": item.get("origin_port", query.origin_port),
-                                "destination_port": item.get("destination_port", query.destination_port),
-                                "carrier": item.get("carrier", "Railway Express"),  # Default carrier
-                                "departure_date_range": item.get("departure_date_range", f"{query.departure_date_from.strftime('%d.%m')} - {query.departure_date_to.strftime('%d.%m.%Y')}"),
-                                "transit_time_days": item.get("transit_time_days") or 15,
-                                "container_type": item.get("container_type"),
-                                "price_from_usd": float(item.get("price_from_usd", 0)),
-                                "is_dangerous_cargo": query.is_dangerous_cargo,
-                                "available_containers": 5,
-                                "booking_deadline": query.departure_date_from.isoformat(),
-                                "webhook_success": True
-                            }
-                            results.append(result)
-                    
-                    if results:
-                        return results
-                    else:
-                        # If no results from webhook, raise exception to trigger fallback
-                        raise Exception("No results from webhook")
-                        
-                except Exception as e:
-                    print(f"❌ DEBUG: Error processing webhook response: {e}")
-                    # Fall through to fallback
-                    raise Exception(f"Webhook response processing error: {e}")
-            else:
-                # If webhook is not available, trigger fallback
-                raise Exception(f"Webhook returned status {response.status_code}")
-                
+        quotes = await collect_provider_quotes(webhook_params)
+        return build_search_results(quotes, query)
     except Exception as e:
         print(f"⚠️ DEBUG: Webhook failed, using fallback data: {e}")
         # Fallback to mock data if webhook fails
-        fallback_results = []
-        
-        # Generate different routes based on popular railway directions
-        routes_data = [
-            {"origin_port": "Ухань", "destination_port": "Москва", "carrier": "China Railways Express", "base_price": 1000, "transit_days": 15, "route_desc": "Популярный маршрут"},
-            {"origin_port": "Пекин", "destination_port": "Минск", "carrier": "New Silk Road Express", "base_price": 1001, "transit_days": 18, "route_desc": "Прямое сообщение"},
-            {"origin_port": "Актау", "destination_port": "Москва", "carrier": "RZD Logistics", "base_price": 1010, "transit_days": 12, "route_desc": "Быстрая доставка"}
-        ]
-        
-        for i, route in enumerate(routes_data):
-            # Add price variation for dangerous cargo
-            price = route["base_price"]
-            if query.is_dangerous_cargo:
-                price = int(price * 1.3)  # 30% markup for dangerous cargo
-                
-            # Add volume discount for multiple containers
-            if query.containers_count > 1:
-                price = int(price * 0.95 * query.containers_count)  # 5% discount per container
-            
-            fallback_results.append({
-                "id": str(uuid.uuid4()),
-                "origin_port": route["origin_port"],
-                "destination_port": route["destination_port"],
-                "carrier": route["carrier"],
-                "departure_date_range": f"{query.departure_date_from.strftime('%d.%m')} - {query.departure_date_to.strftime('%d.%m.%Y')}",
-                "transit_time_days": route["transit_days"],
-                "container_type": query.container_type,
-                "price_from_usd": float(price),
-                "is_dangerous_cargo": query.is_dangerous_cargo,
-                "available_containers": 5 + i,
-                "booking_deadline": query.departure_date_from.isoformat(),
-                "webhook_error": "Тестовые данные (webhook недоступен)"
-            })
-            
-        return fallback_results
+        return await build_fallback_results(query)
+
+@api_router.post("/search")
+async def search_shipments(query: SearchQueryBody):
+    print(f"🔍 DEBUG: Received search query: {query}")
+    return json_response(await execute_search(query))
+
+# Streaming search (NDJSON / Server-Sent Events)
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def encode_stream_event(event: str, data, stream_format: str) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=json_default)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f'{{"event": "{event}", "data": {payload}}}\n'
+
+async def stream_search_events(query: SearchQuery, stream_format: str):
+    """Yield each quote as soon as its provider answers, then fallback quotes if none did"""
+    started = time.perf_counter()
+    ports = await resolve_ports([query.origin_port, query.destination_port])
+    webhook_params = build_webhook_params(query, ports)
+    providers = await get_search_providers()
+    tasks = [asyncio.create_task(query_provider(provider, webhook_params)) for provider in providers]
+    seen = set()
+    sent = 0
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=SEARCH_DEADLINE_SECONDS):
+            try:
+                quotes = await next_done
+            except asyncio.TimeoutError:
+                break
+            except Exception:
+                continue
+            for quote, result in zip(quotes, build_search_results(quotes, query)):
+                key = quote_key(quote)
+                if key in seen:
+                    continue
+                seen.add(key)
+                sent += 1
+                yield encode_stream_event("result", result, stream_format)
+    finally:
+        # Also runs when the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
+    fallback = sent == 0
+    if fallback:
+        for result in await build_fallback_results(query):
+            sent += 1
+            yield encode_stream_event("result", result, stream_format)
+
+    yield encode_stream_event("complete", {
+        "results": sent,
+        "fallback": fallback,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }, stream_format)
+
+@api_router.post("/search/stream")
+async def search_shipments_stream(query: SearchQuery, request: Request,
+                                  stream_format: Optional[str] = Query(None, alias="format")):
+    """Streaming variant of /search: one event per quote, ending with a "complete" event"""
+    if stream_format is None:
+        stream_format = "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    logging.debug(f"🔍 Streaming search query ({stream_format}): {query}")
+    return StreamingResponse(
+        stream_search_events(query, stream_format),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Batch search for bulk quoting
+def group_batch_queries(queries: list, ports: dict) -> list:
+    """Group query indices by webhook params, so identical lanes cost one upstream call"""
+    groups = {}
+    for index, query in enumerate(queries):
+        webhook_params = build_webhook_params(query, ports)
+        key = tuple(sorted(webhook_params.items()))
+        groups.setdefault(key, (webhook_params, []))[1].append(index)
+    return list(groups.values())
+
+async def run_batch_group(queries: list, webhook_params: dict, indices: list, semaphore: asyncio.Semaphore) -> list:
+    async with semaphore:
+        try:
+            quotes = await collect_provider_quotes(webhook_params)
+        except Exception as e:
+            logging.warning(f"⚠️ Batch lane {webhook_params['from']} → {webhook_params['to']} failed, using fallback data: {e}")
+            quotes = None
+    items = []
+    for index in indices:
+        query = queries[index]
+        try:
+            results = build_search_results(quotes, query) if quotes is not None else await build_fallback_results(query)
+            items.append({"index": index, "results": results})
+        except Exception as e:
+            items.append({"index": index, "error": str(e)})
+    return items
+
+async def stream_batch_search(queries: list, groups: list, stream_format: str):
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [asyncio.create_task(run_batch_group(queries, params, indices, semaphore)) for params, indices in groups]
+    completed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                completed += 1
+                yield encode_stream_event("item", item, stream_format)
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield encode_stream_event("complete", {"items": completed, "upstream_calls": len(groups)}, stream_format)
+
+@api_router.post("/search/batch")
+async def search_batch(batch: BatchSearchRequest, stream_format: Optional[str] = Query(None, alias="format")):
+    """Quote many lanes at once; items are keyed by query index and carry either results or an error"""
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Too many queries (max {BATCH_MAX_QUERIES})")
+    if stream_format is not None and stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    # One port lookup for the whole batch
+    port_values = {value for query in batch.queries for value in (query.origin_port, query.destination_port)}
+    ports = await resolve_ports(list(port_values))
+    groups = group_batch_queries(batch.queries, ports)
+    logging.debug(f"🔍 Batch search: {len(batch.queries)} queries, {len(groups)} unique upstream calls")
+
+    if stream_format is not None:
+        return StreamingResponse(
+            stream_batch_search(batch.queries, groups, stream_format),
+            media_type=STREAM_MEDIA_TYPES[stream_format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    grouped_items = await asyncio.gather(*(run_batch_group(batch.queries, params, indices, semaphore)
+                                           for params, indices in groups))
+    items = sorted((item for group in grouped_items for item in group), key=lambda item: item["index"])
+    return json_response({"items": items, "upstream_calls": len(groups)})
+
+# Flexible-date price calendar
+def calendar_windows(calendar_query: PriceCalendarQuery) -> list:
+    step = 1 if calendar_query.granularity == "day" else 7
+    windows = []
+    start = calendar_query.date_from
+    while start <= calendar_query.date_to:
+        end = min(start + timedelta(days=step - 1), calendar_query.date_to)
+        windows.append((start, end))
+        start = end + timedelta(days=1)
+    return windows
+
+async def price_calendar_window(calendar_query: PriceCalendarQuery, window: tuple, ports: dict,
+                                semaphore: asyncio.Semaphore) -> dict:
+    window_start, window_end = window
+    query = SearchQuery(
+        origin_port=calendar_query.origin_port,
+        destination_port=calendar_query.destination_port,
+        departure_date_from=window_start,
+        departure_date_to=window_end,
+        container_type=calendar_query.container_type,
+        is_dangerous_cargo=calendar_query.is_dangerous_cargo,
+        containers_count=calendar_query.containers_count,
+    )
+    async with semaphore:
+        results = await execute_search(query, ports)
+    # Mock quotes belong to other lanes, so a window priced only by them has no price
+    results = [result for result in results if result.get("webhook_error") != MOCK_RESULTS_NOTE]
+    cheapest = min(results, key=lambda result: result["price_from_usd"], default=None)
+    return {
+        "window_start": window_start.isoformat(),
+        "window_end": window_end.isoformat(),
+        "cheapest_price_usd": cheapest["price_from_usd"] if cheapest else None,
+        "carrier": cheapest["carrier"] if cheapest else None,
+        "result_count": len(results),
+        "fallback": bool(cheapest and "webhook_error" in cheapest),
+    }
+
+def summarize_calendar(entries: list) -> dict:
+    entries = sorted(entries, key=lambda entry: entry["window_start"])
+    priced = [entry for entry in entries if entry["cheapest_price_usd"] is not None]
+    return {
+        "calendar": entries,
+        "cheapest": min(priced, key=lambda entry: entry["cheapest_price_usd"], default=None),
+    }
+
+async def stream_price_calendar(calendar_query: PriceCalendarQuery, windows: list, ports: dict, stream_format: str):
+    semaphore = asyncio.Semaphore(CALENDAR_CONCURRENCY)
+    tasks = [asyncio.create_task(price_calendar_window(calendar_query, window, ports, semaphore)) for window in windows]
+    entries = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            entry = await next_done
+            entries.append(entry)
+            yield encode_stream_event("window", entry, stream_format)
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield encode_stream_event("complete", summarize_calendar(entries), stream_format)
+
+@api_router.post("/search/calendar")
+async def search_price_calendar(calendar_query: PriceCalendarQuery,
+                                stream_format: Optional[str] = Query(None, alias="format")):
+    """Cheapest price per day or week for a lane; ?format=ndjson|sse streams windows as they complete"""
+    if calendar_query.granularity not in ("day", "week"):
+        raise HTTPException(status_code=400, detail="granularity must be 'day' or 'week'")
+    if calendar_query.date_to < calendar_query.date_from:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    if stream_format is not None and stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    windows = calendar_windows(calendar_query)
+    if len(windows) > CALENDAR_MAX_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Date range is too wide (max {CALENDAR_MAX_WINDOWS} windows)")
+
+    # Ports are resolved once for every window
+    ports = await resolve_ports([calendar_query.origin_port, calendar_query.destination_port])
+    if stream_format is not None:
+        return StreamingResponse(
+            stream_price_calendar(calendar_query, windows, ports, stream_format),
+            media_type=STREAM_MEDIA_TYPES[stream_format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    semaphore = asyncio.Semaphore(CALENDAR_CONCURRENCY)
+    entries = await asyncio.gather(*(price_calendar_window(calendar_query, window, ports, semaphore) for window in windows))
+    return json_response(summarize_calendar(list(entries)))
+
+# Departure schedules for a lane and date window
+@api_router.post("/schedules")
+async def get_schedules(query: SearchQueryBody):
+    engine = await get_pricing_engine()
+    schedules = await get_schedule_index()
+    indices, _ = engine.quote(query.origin_port, query.destination_port, query.container_type, False, 1)
+    results = []
+    for i in indices.tolist():
+        route = engine.routes[i]
+        results.append({
+            "route_id": str(route["id"]),
+            "carrier": route["carrier"],
+            "frequency": route.get("frequency"),
+            "transit_time_days": int(engine.transit_days[i]),
+            "sailings": schedules.sailings(i, query.departure_date_from, query.departure_date_to),
+        })
+    return json_response(results)
+
+# Multi-leg itineraries (transshipment via intermediate ports)
+@api_router.post("/search/itineraries")
+async def search_itineraries(query: ItineraryQuery):
+    if query.sort_by not in ("price", "transit_time"):
+        raise HTTPException(status_code=400, detail="sort_by must be 'price' or 'transit_time'")
+    graph = await get_route_graph()
+    return graph.k_best(query.origin_port, query.destination_port, query.k, query.max_hops,
+                        query.sort_by, query.container_type)
 
 @api_router.post("/calculation")
 async def calculate_rate(calc_req: CalculationRequest):
     print(f"🔍 DEBUG: Click calculation")
-    pool = await get_db_pool()
 
     # 1. Отправляем на внешний webhook
     url = f"{N8N_WEBHOOK_BASE}/calculate"
     payload = {"shipmentId": calc_req.shipmentId, "clientId": calc_req.clientId}
 
-    import httpx
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, timeout=30)
-            if response.status_code == 200:
-                logging.info(f"📦 Calculation webhook response: {response.json()}")
-                webhook_response = response.json()
-            else:
-                logging.warning(f"⚠️ Webhook returned status {response.status_code}")
-                webhook_response = {"error": f"Webhook returned {response.status_code}"}
+        response = await webhook_request("calculate", "POST", url, json=payload)
+        if response.status_code == 200:
+            logging.info(f"📦 Calculation webhook response: {response.json()}")
+            webhook_response = response.json()
+        else:
+            logging.warning(f"⚠️ Webhook returned status {response.status_code}")
+            webhook_response = {"error": f"Webhook returned {response.status_code}"}
     except Exception as e:
         logging.error(f"❌ Webhook call failed: {e}")
         webhook_response = {"error": str(e)}
 
-    # 2. Сохраняем клик в БД
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO calculate_clicks (rout_id, user_id, created_at)
-            VALUES ($1, $2, NOW())
-            """,
-            calc_req.shipmentId,
-            calc_req.clientId,
-        )
+    # 2. Сохраняем клик в буфер, запись в БД пачками (COPY) в фоне
+    click_buffer.add(calc_req.shipmentId, calc_req.clientId)
 
     return {"message": "Calculation processed", "webhook_response": webhook_response}
 
@@ -469,10 +2580,11 @@ async def register_user(user_data: UserRegistration):
         existing_user = await conn.fetchrow('SELECT id FROM users WHERE email = $1', user_data.email)
         if existing_user:
             raise HTTPException(status_code=400, detail="User already exists")
-        
-        # Hash password
-        password_hash = get_password_hash(user_data.password).decode('utf-8')
-        
+    
+    # Hash password in the bcrypt thread pool without holding a DB connection
+    password_hash = await password_hasher.hash(user_data.password)
+    
+    async with pool.acquire() as conn:
         user_id = str(uuid.uuid4())
         await conn.execute('''
             INSERT INTO users (id, email, password_hash, created_at)
@@ -529,16 +2641,172 @@ async def update_webhook_settings(webhook_url: dict, current_admin: str = Depend
     
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Delete old settings and insert new
-        await conn.execute('DELETE FROM webhook_settings')
-        webhook_id = str(uuid.uuid4())
-        await conn.execute('''
-            INSERT INTO webhook_settings (id, webhook_url, updated_at)
-            VALUES ($1, $2, NOW())
-        ''', webhook_id, url)
+        async with conn.transaction():
+            # Delete old settings and insert new
+            await conn.execute('DELETE FROM webhook_settings')
+            webhook_id = str(uuid.uuid4())
+            await conn.execute('''
+                INSERT INTO webhook_settings (id, webhook_url, updated_at)
+                VALUES ($1, $2, NOW())
+            ''', webhook_id, url)
+            invalidation = await publish_invalidation(conn, "webhook_settings")
+        apply_invalidation(invalidation)
     
     return {"message": "Webhook URL updated successfully"}
 
+# Admin HTTP client pool stats
+@api_router.get("/admin/http-pool")
+async def get_http_pool(current_admin: str = Depends(get_current_admin)):
+    return get_http_pool_stats()
+
+# Admin search cache
+@api_router.get("/admin/search-cache")
+async def get_search_cache_stats(current_admin: str = Depends(get_current_admin)):
+    return {**search_cache.stats(), "coalescing": search_flight.stats()}
+
+@api_router.delete("/admin/search-cache")
+async def purge_search_cache(current_admin: str = Depends(get_current_admin)):
+    purged = search_cache.purge()
+    return {"message": "Search cache purged", "purged_entries": purged}
+
+# Admin reference data cache
+@api_router.get("/admin/reference-cache")
+async def get_reference_cache_stats(current_admin: str = Depends(get_current_admin)):
+    return reference_cache.stats()
+
+@api_router.delete("/admin/reference-cache")
+async def invalidate_reference_cache(current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await publish_invalidation(conn, "*")
+    return {"message": "Reference data cache invalidated"}
+
+# Admin booking outbox
+@api_router.get("/admin/booking-outbox")
+async def get_booking_outbox_stats(current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        status_rows = await conn.fetch("""
+            SELECT status, COUNT(*) AS count, EXTRACT(EPOCH FROM NOW() - MIN(created_at)) AS oldest_age_seconds
+            FROM booking_outbox GROUP BY status
+        """)
+        latency = await conn.fetchrow("""
+            SELECT COUNT(*) AS delivered,
+                   AVG(EXTRACT(EPOCH FROM delivered_at - created_at)) AS avg_seconds,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM delivered_at - created_at)) AS p50_seconds,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM delivered_at - created_at)) AS p95_seconds
+            FROM booking_outbox WHERE delivered_at > NOW() - INTERVAL '1 hour'
+        """)
+        dead_rows = await conn.fetch("""
+            SELECT id, attempts, last_error, created_at FROM booking_outbox
+            WHERE status = 'dead' ORDER BY created_at DESC LIMIT 20
+        """)
+    statuses = {row["status"]: {"count": row["count"], "oldest_age_seconds": float(row["oldest_age_seconds"] or 0)}
+                for row in status_rows}
+    return {
+        "queue_depth": statuses.get("pending", {}).get("count", 0),
+        "statuses": statuses,
+        "delivery_latency_last_hour": {key: float(value) if value is not None else None for key, value in latency.items()},
+        "dead_letters": [dict(row) for row in dead_rows],
+    }
+
+@api_router.post("/admin/booking-outbox/{booking_id}/retry")
+async def retry_outbox_booking(booking_id: str, current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        result = await conn.execute("""
+            UPDATE booking_outbox SET status = 'pending', attempts = 0, next_attempt_at = NOW()
+            WHERE id = $1 AND status = 'dead'
+        """, booking_id)
+        if result == 'UPDATE 0':
+            raise HTTPException(status_code=404, detail="Dead booking not found")
+    booking_outbox_wakeup.set()
+    return {"message": "Booking requeued"}
+
+# Admin click buffer stats
+@api_router.get("/admin/click-buffer")
+async def get_click_buffer_stats(current_admin: str = Depends(get_current_admin)):
+    return click_buffer.stats()
+
+# Admin password hashing stats
+@api_router.get("/admin/password-hashing")
+async def get_password_hashing_stats(current_admin: str = Depends(get_current_admin)):
+    return password_hasher.stats()
+
+# Admin auth cache stats
+@api_router.get("/admin/auth-cache")
+async def get_auth_cache_stats(current_admin: str = Depends(get_current_admin)):
+    return {"tokens": token_cache.stats(), "users": {**user_cache.stats(), "ttl_seconds": USER_CACHE_TTL}}
+
+# Admin search providers
+@api_router.get("/admin/search-providers")
+async def get_admin_search_providers(current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch('SELECT * FROM search_providers ORDER BY name')
+    providers = []
+    for row in rows:
+        stats = provider_stats.get(row["id"], {})
+        calls = stats.get("calls", 0)
+        providers.append({
+            **dict(row),
+            "stats": {**stats, "avg_latency_ms": round(stats["total_latency_ms"] / calls, 2) if calls else None},
+        })
+    return providers
+
+@api_router.post("/admin/search-providers")
+async def create_search_provider(provider: SearchProvider, current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO search_providers (id, name, webhook_url, enabled, created_at)
+            VALUES ($1, $2, $3, $4, NOW())
+        ''', provider.id, provider.name, provider.webhook_url, provider.enabled)
+        await publish_invalidation(conn, "search_providers")
+    return {"message": "Search provider created", "id": provider.id}
+
+@api_router.delete("/admin/search-providers/{provider_id}")
+async def delete_search_provider(provider_id: str, current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        result = await conn.execute('DELETE FROM search_providers WHERE id = $1', provider_id)
+        if result == 'DELETE 0':
+            raise HTTPException(status_code=404, detail="Search provider not found")
+        await publish_invalidation(conn, "search_providers")
+    provider_stats.pop(provider_id, None)
+    return {"message": "Search provider deleted"}
+
+# Admin circuit breakers
+@api_router.get("/admin/circuit-breakers")
+async def get_circuit_breakers(current_admin: str = Depends(get_current_admin)):
+    return {
+        "settings": {
+            "window_size": CIRCUIT_WINDOW_SIZE,
+            "min_calls": CIRCUIT_MIN_CALLS,
+            "failure_rate_threshold": CIRCUIT_FAILURE_RATE_THRESHOLD,
+            "slow_call_seconds": CIRCUIT_SLOW_CALL_SECONDS,
+            "slow_call_rate_threshold": CIRCUIT_SLOW_CALL_RATE_THRESHOLD,
+            "open_seconds": CIRCUIT_OPEN_SECONDS,
+            "half_open_calls": CIRCUIT_HALF_OPEN_CALLS,
+        },
+        "breakers": {url: breaker.stats() for url, breaker in circuit_breakers.items()},
+    }
+
+@api_router.post("/admin/circuit-breakers/reset")
+async def reset_circuit_breakers(current_admin: str = Depends(get_current_admin)):
+    circuit_breakers.clear()
+    return {"message": "Circuit breakers reset"}
+
+# Admin hedged request stats
+@api_router.get("/admin/hedging")
+async def get_hedging_stats(current_admin: str = Depends(get_current_admin)):
+    return {
+        "enabled": SEARCH_HEDGING_ENABLED,
+        "percentile": SEARCH_HEDGE_PERCENTILE,
+        "max_rate": SEARCH_HEDGE_MAX_RATE,
+        "webhooks": {url: policy.stats() for url, policy in hedge_policies.items()},
+    }
+
 # Admin container types
 @api_router.get("/admin/container-types")
 async def get_admin_container_types(current_admin: str = Depends(get_current_admin)):
@@ -554,22 +2822,118 @@ async def delete_container_type(container_id: str, current_admin: str = Depends(
         result = await conn.execute('DELETE FROM container_types WHERE id = $1', container_id)
         if result == 'DELETE 0':
             raise HTTPException(status_code=404, detail="Container type not found")
+        await publish_invalidation(conn, "container_types")
     return {"message": "Container type deleted"}
 
 # Admin routes
+def route_filters(origin: Optional[str], destination: Optional[str], carrier: Optional[str],
+                  transport_type: Optional[str]):
+    conditions, args = [], []
+    for column, value in (("origin_port", origin), ("destination_port", destination),
+                          ("carrier", carrier), ("transport_type", transport_type)):
+        if value:
+            args.append(value)
+            conditions.append(f"{column} = ${len(args)}")
+    return conditions, args
+
+def encode_route_cursor(row) -> str:
+    key = [row["origin_port"], row["destination_port"], str(row["id"])]
+    return base64.urlsafe_b64encode(orjson.dumps(key)).decode('ascii')
+
+def decode_route_cursor(cursor: str) -> list:
+    try:
+        key = orjson.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != 3 or not all(isinstance(value, str) for value in key):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
 @api_router.get("/admin/routes")
-async def get_admin_routes(current_admin: str = Depends(get_current_admin)):
+async def get_admin_routes(response: Response, origin: Optional[str] = None, destination: Optional[str] = None,
+                           carrier: Optional[str] = None, transport_type: Optional[str] = None,
+                           cursor: Optional[str] = None,
+                           limit: int = Query(ADMIN_ROUTES_PAGE_SIZE, ge=1, le=ADMIN_ROUTES_MAX_PAGE_SIZE),
+                           current_admin: str = Depends(get_current_admin)):
+    """One page of routes; the next page's cursor is returned in the X-Next-Cursor header"""
+    conditions, args = route_filters(origin, destination, carrier, transport_type)
+    if cursor:
+        args.extend(decode_route_cursor(cursor))
+        n = len(args)
+        conditions.append(f"(origin_port, destination_port, id) > (${n - 2}, ${n - 1}, ${n})")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    args.append(limit)
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT * FROM shipping_routes ORDER BY origin_port, destination_port')
-        results = []
-        for row in rows:
-            row_dict = dict(row)
-            # Parse JSON available_container_types
-            if row_dict['available_container_types']:
-                row_dict['available_container_types'] = json.loads(row_dict['available_container_types'])
-            results.append(row_dict)
-        return results
+        rows = await conn.fetch(f'''
+            SELECT * FROM shipping_routes {where}
+            ORDER BY origin_port, destination_port, id
+            LIMIT ${len(args)}
+        ''', *args)
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_route_cursor(rows[-1])
+    return [dict(row) for row in rows]
+
+async def stream_routes_export(query: str, args: list, export_format: str):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        # Server-side cursors only live inside a transaction
+        async with conn.transaction():
+            records = conn.cursor(query, *args, prefetch=ADMIN_ROUTES_EXPORT_PREFETCH)
+            if export_format == "json":
+                separator = b"["
+                async for record in records:
+                    yield separator + orjson.dumps(dict(record), default=json_default)
+                    separator = b",\n"
+                yield b"[]" if separator == b"[" else b"]"
+                return
+            buffer = io.StringIO()
+            writer = None
+            async for record in records:
+                if writer is None:
+                    writer = csv.writer(buffer)
+                    writer.writerow(record.keys())
+                writer.writerow([
+                    ";".join(map(str, value)) if isinstance(value, list) else json_default(value) if value is not None else ""
+                    for value in record.values()
+                ])
+                if buffer.tell() >= 65536:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue().encode('utf-8')
+
+@api_router.get("/admin/routes/export")
+async def export_admin_routes(origin: Optional[str] = None, destination: Optional[str] = None,
+                              carrier: Optional[str] = None, transport_type: Optional[str] = None,
+                              export_format: str = Query("json", alias="format"),
+                              current_admin: str = Depends(get_current_admin)):
+    """Stream every matching route as a JSON array or CSV without loading the table into memory"""
+    if export_format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'csv'")
+    conditions, args = route_filters(origin, destination, carrier, transport_type)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f'SELECT * FROM shipping_routes {where} ORDER BY origin_port, destination_port, id'
+    media_type = "application/json" if export_format == "json" else "text/csv"
+    return StreamingResponse(
+        stream_routes_export(query, args, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="shipping_routes.{export_format}"'},
+    )
+
+@api_router.post("/admin/routes")
+async def create_route(route: ShippingRoute, current_admin: str = Depends(get_current_admin)):
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO shipping_routes (id, origin_port, destination_port, transport_type, carrier,
+                                         transit_time_days, base_price_usd, available_container_types, frequency, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        ''', route.id, route.origin_port, route.destination_port, route.transport_type, route.carrier,
+            route.transit_time_days, route.base_price_usd, route.available_container_types,
+            route.frequency, route.created_at)
+        await publish_invalidation(conn, "shipping_routes", f"route:{route.id}")
+    return {"message": "Route created", "id": route.id}
 
 @api_router.delete("/admin/routes/{route_id}")
 async def delete_route(route_id: str, current_admin: str = Depends(get_current_admin)):
@@ -578,38 +2942,221 @@ async def delete_route(route_id: str, current_admin: str = Depends(get_current_a
         result = await conn.execute('DELETE FROM shipping_routes WHERE id = $1', route_id)
         if result == 'DELETE 0':
             raise HTTPException(status_code=404, detail="Route not found")
+        await publish_invalidation(conn, "shipping_routes", f"route:{route_id}")
     return {"message": "Route deleted"}
 
+# Bulk import of reference tables: validate in chunks, COPY into a staging table, upsert in one transaction
+IMPORT_MODELS = {
+    "shipping_routes": ShippingRoute,
+    "ports": Port,
+    "container_types": ContainerType,
+}
+IMPORT_FORMATS = ("csv", "json", "ndjson")
+# Rows without an id are matched to existing rows by these columns, so re-importing a sheet
+# updates lanes/ports in place and keeps the ids that routes and clients refer to
+IMPORT_NATURAL_KEYS = {
+    "shipping_routes": ("origin_port", "destination_port", "carrier", "transport_type"),
+    "ports": ("code",),
+    "container_types": ("name",),
+}
+IMPORT_ID_NAMESPACE = uuid.UUID("5b8e7d1c-3f0a-4c2e-9a61-7d4f2b9c0e13")
+
+def natural_key_id(table: str, item: dict) -> str:
+    """Stable id for a new row without one: repeated rows in a file collapse to the same id"""
+    key = "|".join([table, *(str(item[column]).strip().casefold() for column in IMPORT_NATURAL_KEYS[table])])
+    return str(uuid.uuid5(IMPORT_ID_NAMESPACE, key))
+
+def detect_import_format(file: UploadFile) -> str:
+    extension = (file.filename or "").rsplit(".", 1)[-1].lower()
+    if extension in IMPORT_FORMATS:
+        return extension
+    content_type = (file.content_type or "").lower()
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        return "ndjson"
+    if "json" in content_type:
+        return "json"
+    return "csv"
+
+async def iter_import_rows(file: UploadFile, import_format: str):
+    """Yield raw row dicts; CSV and NDJSON are read incrementally, a JSON array is parsed at once"""
+    if import_format == "json":
+        rows = orjson.loads(await file.read())
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="JSON import must be an array of objects")
+        for row in rows:
+            yield row
+        return
+    if import_format == "csv":
+        text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+        try:
+            for row in csv.DictReader(text):
+                yield row
+        finally:
+            text.detach()
+        return
+    pending = b""
+    while chunk := await file.read(65536):
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield orjson.loads(line)
+    if pending.strip():
+        yield orjson.loads(pending)
+
+def coerce_import_row(row: dict, model) -> dict:
+    """Flat CSV cells -> model input: blanks use defaults, list columns accept JSON or 'a;b;c'"""
+    values = {}
+    for name, value in row.items():
+        if name not in model.model_fields:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                continue
+            if model.model_fields[name].annotation == List[str]:
+                value = orjson.loads(value) if value.startswith("[") else [item.strip() for item in value.split(";") if item.strip()]
+        values[name] = value
+    return values
+
+async def stage_import_chunk(conn, table: str, chunk: list, model, columns: list, errors: list) -> int:
+    records = []
+    for line_number, row in chunk:
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("row must be an object")
+            values = coerce_import_row(row, model)
+            item = model.model_validate(values).model_dump()
+            id_provided = "id" in values
+            if not id_provided:
+                item["id"] = natural_key_id(table, item)
+        except ValidationError as e:
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"row": line_number, "error": "; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+            continue
+        except ValueError as e:
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"row": line_number, "error": str(e)})
+            continue
+        records.append((line_number, id_provided, *(item[column] for column in columns)))
+    if records and not errors:
+        await conn.copy_records_to_table('import_staging', records=records,
+                                          columns=['import_row', 'id_provided', *columns])
+    return len(records)
+
+@api_router.post("/admin/import/{table}")
+async def import_reference_table(table: str, file: UploadFile = File(...), mode: str = "upsert",
+                                 import_format: Optional[str] = Query(None, alias="format"),
+                                 current_admin: str = Depends(get_current_admin)):
+    """Load a CSV/JSON/NDJSON file into shipping_routes, ports or container_types.
+    Rows are matched by id, or by IMPORT_NATURAL_KEYS when the file has no id for them.
+    mode=upsert inserts or updates matched rows; mode=replace also deletes rows missing from the file.
+    Nothing is applied if any row fails validation."""
+    model = IMPORT_MODELS.get(table)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Import is supported for: {', '.join(IMPORT_MODELS)}")
+    if mode not in ("upsert", "replace"):
+        raise HTTPException(status_code=400, detail="mode must be 'upsert' or 'replace'")
+    import_format = import_format or detect_import_format(file)
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'csv', 'json' or 'ndjson'")
+
+    started = time.perf_counter()
+    errors, received, staged = [], 0, 0
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            table_columns = {row['column_name'] for row in await conn.fetch('''
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = $1
+            ''', table)}
+            columns = [name for name in model.model_fields if name in table_columns]
+            await conn.execute(f'CREATE TEMP TABLE import_staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP')
+            await conn.execute('ALTER TABLE import_staging ADD COLUMN import_row BIGINT, ADD COLUMN id_provided BOOLEAN')
+
+            chunk = []
+            try:
+                async for row in iter_import_rows(file, import_format):
+                    received += 1
+                    chunk.append((received, row))
+                    if len(chunk) >= IMPORT_CHUNK_ROWS:
+                        staged += await stage_import_chunk(conn, table, chunk, model, columns, errors)
+                        chunk = []
+                staged += await stage_import_chunk(conn, table, chunk, model, columns, errors)
+            except (ValueError, csv.Error) as e:
+                raise HTTPException(status_code=400, detail=f"Could not parse {import_format} near row {received + 1}: {e}")
+            if errors:
+                raise HTTPException(status_code=422, detail={"message": "Import rejected, nothing was applied",
+                                                             "received": received, "errors": errors})
+
+            # Reuse the ids of existing rows with the same natural key
+            natural_key = ", ".join(IMPORT_NATURAL_KEYS[table])
+            natural_key_target = ", ".join(f"lower(btrim(t.{column}))" for column in IMPORT_NATURAL_KEYS[table])
+            natural_key_staged = ", ".join(f"lower(btrim(s.{column}))" for column in IMPORT_NATURAL_KEYS[table])
+            await conn.execute(f'''
+                UPDATE import_staging AS s SET id = t.id
+                FROM (SELECT DISTINCT ON ({natural_key}) id, {natural_key} FROM {table} ORDER BY {natural_key}, id) AS t
+                WHERE NOT s.id_provided AND ({natural_key_target}) IS NOT DISTINCT FROM ({natural_key_staged})
+            ''')
+            column_list = ", ".join(columns)
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ("id", "created_at"))
+            deleted = 0
+            if mode == "replace":
+                result = await conn.execute(f'DELETE FROM {table} WHERE id NOT IN (SELECT id FROM import_staging)')
+                deleted = int(result.split()[-1])
+            # The last occurrence of a repeated id wins
+            result = await conn.execute(f'''
+                INSERT INTO {table} ({column_list})
+                SELECT DISTINCT ON (id) {column_list} FROM import_staging ORDER BY id, import_row DESC
+                ON CONFLICT (id) DO UPDATE SET {updates}
+            ''')
+            upserted = int(result.split()[-1])
+            names = [table, "route_graph"] if table == "shipping_routes" else [table]
+            invalidation = await publish_invalidation(conn, *names)
+        apply_invalidation(invalidation)
+
+    duration = time.perf_counter() - started
+    logging.info(f"📥 Imported {upserted} rows into {table} ({mode}, {deleted} deleted) in {duration:.2f}s")
+    return {"table": table, "mode": mode, "received": received, "upserted": upserted,
+            "deleted": deleted, "duration_seconds": round(duration, 3)}
+
 # Delivery terms endpoint - условия поставки для выпадающего списка
+# Стандартные условия поставки (Инкотермс)
+DELIVERY_TERMS = [
+    {"code": "EXW", "name": "EXW - Самовывоз (Ex Works)", "description": "Поставка с завода"},
+    {"code": "FCA", "name": "FCA - Франко перевозчик (Free Carrier)", "description": "Франко перевозчик в указанном месте"},
+    {"code": "CPT", "name": "CPT - Перевозка оплачена до (Carriage Paid To)", "description": "Перевозка оплачена до места назначения"},
+    {"code": "CIP", "name": "CIP - Перевозка и страхование оплачены до (Carriage and Insurance Paid To)", "description": "Перевозка и страхование оплачены до места назначения"},
+    {"code": "DAP", "name": "DAP - Поставка в месте назначения (Delivered At Place)", "description": "Поставка в указанном месте назначения"},
+    {"code": "DPU", "name": "DPU - Поставка в месте назначения с разгрузкой (Delivered at Place Unloaded)", "description": "Поставка с разгрузкой в указанном месте"},
+    {"code": "DDP", "name": "DDP - Поставка с оплатой пошлин (Delivered Duty Paid)", "description": "Поставка с оплатой всех пошлин и сборов"},
+    {"code": "FAS", "name": "FAS - Франко вдоль борта судна (Free Alongside Ship)", "description": "Для морских перевозок"},
+    {"code": "FOB", "name": "FOB - Франко борт (Free On Board)", "description": "Для морских перевозок"},
+    {"code": "CFR", "name": "CFR - Стоимость и фрахт (Cost and Freight)", "description": "Для морских перевозок"},
+    {"code": "CIF", "name": "CIF - Стоимость, страхование и фрахт (Cost, Insurance and Freight)", "description": "Для морских перевозок"}
+]
+# Static list: serialized, hashed and compressed once
+delivery_terms_entry = ReferenceEntry(DELIVERY_TERMS, json.dumps(DELIVERY_TERMS, ensure_ascii=False).encode('utf-8'), 0)
+
 @api_router.get("/delivery-terms")
-async def get_delivery_terms():
+async def get_delivery_terms(request: Request):
     """Получить список условий поставки для выпадающего списка"""
-    # Стандартные условия поставки (Инкотермс)
-    delivery_terms = [
-        {"code": "EXW", "name": "EXW - Самовывоз (Ex Works)", "description": "Поставка с завода"},
-        {"code": "FCA", "name": "FCA - Франко перевозчик (Free Carrier)", "description": "Франко перевозчик в указанном месте"},
-        {"code": "CPT", "name": "CPT - Перевозка оплачена до (Carriage Paid To)", "description": "Перевозка оплачена до места назначения"},
-        {"code": "CIP", "name": "CIP - Перевозка и страхование оплачены до (Carriage and Insurance Paid To)", "description": "Перевозка и страхование оплачены до места назначения"},
-        {"code": "DAP", "name": "DAP - Поставка в месте назначения (Delivered At Place)", "description": "Поставка в указанном месте назначения"},
-        {"code": "DPU", "name": "DPU - Поставка в месте назначения с разгрузкой (Delivered at Place Unloaded)", "description": "Поставка с разгрузкой в указанном месте"},
-        {"code": "DDP", "name": "DDP - Поставка с оплатой пошлин (Delivered Duty Paid)", "description": "Поставка с оплатой всех пошлин и сборов"},
-        {"code": "FAS", "name": "FAS - Франко вдоль борта судна (Free Alongside Ship)", "description": "Для морских перевозок"},
-        {"code": "FOB", "name": "FOB - Франко борт (Free On Board)", "description": "Для морских перевозок"},
-        {"code": "CFR", "name": "CFR - Стоимость и фрахт (Cost and Freight)", "description": "Для морских перевозок"},
-        {"code": "CIF", "name": "CIF - Стоимость, страхование и фрахт (Cost, Insurance and Freight)", "description": "Для морских перевозок"}
-    ]
-    return delivery_terms
+    return conditional_response(request, delivery_terms_entry)
 
 # Booking endpoint - эндпоинт для создания бронирования
 @api_router.post("/booking", response_model=BookingResponse)
-async def create_booking(booking_data: BookingRequest):
+async def create_booking(booking_data: BookingRequestBody):
     """
     Создать заявку на бронирование с последующей отправкой в систему торгов
     
     Этот эндпоинт:
     1. Генерирует UUID для бронирования
-    2. Отправляет собранные данные из формы в webhook n8n
-    3. Возвращает ID бронирования и статус
+    2. Сохраняет собранные данные из формы в outbox (booking_outbox)
+    3. Сразу возвращает ID бронирования и статус
+    
+    Фоновый диспетчер отправляет заявку в webhook n8n с повторами
+    (экспоненциальная задержка) и переводит её в статус dead после
+    BOOKING_OUTBOX_MAX_ATTEMPTS неудачных попыток.
     
     После создания бронирования n8n выполнит:
     - Уведомление перевозчиков через WA о запросе снижения цены
@@ -643,30 +3190,20 @@ async def create_booking(booking_data: BookingRequest):
             "event_type": "booking_created"
         }
         
-        # Отправляем на внешний webhook
-        url = f"{N8N_WEBHOOK_BASE}/logistics/application-get"
-        
-        import httpx
-        webhook_sent = False
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, timeout=30)
-                if response.status_code == 200:
-                    logging.info(f"📦 Booking webhook response: {response.json()}")
-                    webhook_response = response.json()
-                    webhook_sent = True
-                else:
-                    logging.warning(f"⚠️ Webhook returned status {response.status_code}")
-                    webhook_response = {"error": f"Webhook returned {response.status_code}"}
-        except Exception as e:
-            logging.error(f"❌ Webhook call failed: {e}")
-            webhook_response = {"error": str(e)}
+        # Сохраняем заявку в outbox, доставка в n8n выполняется фоновым диспетчером
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO booking_outbox (id, payload)
+                VALUES ($1, $2)
+            ''', booking_id, json.dumps(payload, ensure_ascii=False))
+        booking_outbox_wakeup.set()
         
         return BookingResponse(
             booking_id=booking_id,
             status="created",
-            message="Заявка на бронирование создана успешно. Данные отправлены в систему торгов.",
-            webhook_sent=webhook_sent
+            message="Заявка на бронирование создана успешно. Данные поставлены в очередь на отправку в систему торгов.",
+            webhook_sent=False
         )
         
     except Exception as e:
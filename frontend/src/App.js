@@ -1008,15 +1008,30 @@ const AdminPanel = ({ token, onLogout, onBack }) => {
     fetchWebhookSettings();
   }, []);
 
+  // Маршруты отдаются постранично: курсор следующей страницы приходит в заголовке X-Next-Cursor
+  const fetchAllRoutes = async () => {
+    const allRoutes = [];
+    let cursor = null;
+    do {
+      const response = await axios.get(`${API}/admin/routes`, {
+        ...authHeaders,
+        params: cursor ? { cursor } : {}
+      });
+      allRoutes.push(...response.data);
+      cursor = response.headers['x-next-cursor'] || null;
+    } while (cursor);
+    return allRoutes;
+  };
+
   const fetchAdminData = async () => {
     setLoading(true);
     try {
-      const [containerRes, routesRes] = await Promise.all([
+      const [containerRes, allRoutes] = await Promise.all([
         axios.get(`${API}/admin/container-types`, authHeaders),
-        axios.get(`${API}/admin/routes`, authHeaders)
+        fetchAllRoutes()
       ]);
       setContainerTypes(containerRes.data);
-      setRoutes(routesRes.data);
+      setRoutes(allRoutes);
     } catch (error) {
       console.error('Ошибка загрузки данных админки:', error);
     } finally {
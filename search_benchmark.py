@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""CPU cost per /api/search request: default FastAPI path vs FAST_JSON, with request bodies
+decoded by msgspec (as deployed) and by the pydantic fallback used when msgspec is missing.
+
+Runs the app in-process with execute_search patched to return a fixed result list,
+so only request decoding, response encoding and framework overhead are measured.
+
+    python search_benchmark.py [results] [requests]
+"""
+import os
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+RESULTS = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+def run_mode():
+    os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    if os.environ.get("BENCHMARK_DECODER") == "pydantic":
+        sys.modules["msgspec"] = None  # force the ImportError fallback
+    import builtins
+    import server
+    if os.environ["FAST_JSON"] == "true":
+        decoder = "msgspec" if server.msgspec is not None else "pydantic"
+        assert decoder == os.environ["BENCHMARK_DECODER"], f"expected {os.environ['BENCHMARK_DECODER']}, got {decoder}"
+    from fastapi.testclient import TestClient
+
+    today = date.today()
+    results = [
+        {
+            "id": f"route-{i}",
+            "origin_port": "Shanghai",
+            "destination_port": "Saint Petersburg",
+            "carrier": f"Carrier {i % 12}",
+            "departure_date_range": f"{today:%d.%m} - {today + timedelta(days=7):%d.%m.%Y}",
+            "transit_time_days": 30 + i % 15,
+            "container_type": "40ft High Cube",
+            "price_from_usd": 2500.0 + i * 13.5,
+            "is_dangerous_cargo": False,
+            "available_containers": 5,
+            "booking_deadline": today + timedelta(days=3),
+            "webhook_success": True,
+        }
+        for i in range(RESULTS)
+    ]
+
+    async def execute_search(query, ports=None):
+        return results
+
+    server.execute_search = execute_search
+    builtins.print = lambda *args, **kwargs: None  # endpoint debug output
+    body = {
+        "origin_port": "SHA",
+        "destination_port": "LED",
+        "departure_date_from": today.isoformat(),
+        "departure_date_to": (today + timedelta(days=7)).isoformat(),
+        "container_type": "40ft High Cube",
+        "is_dangerous_cargo": False,
+        "containers_count": 2,
+    }
+    client = TestClient(server.app)  # no startup events: the benchmark needs no database
+    for _ in range(100):
+        client.post("/api/search", json=body)
+    started_cpu, started_wall = time.process_time(), time.perf_counter()
+    for _ in range(REQUESTS):
+        response = client.post("/api/search", json=body)
+    cpu, wall = time.process_time() - started_cpu, time.perf_counter() - started_wall
+    assert response.status_code == 200 and len(response.json()) == RESULTS
+    sys.__stdout__.write(f"{cpu / REQUESTS * 1e6:.0f} {wall / REQUESTS * 1e6:.0f}\n")
+
+def measure(fast_json: bool, decoder: str = "pydantic"):
+    env = dict(os.environ, FAST_JSON="true" if fast_json else "false", BENCHMARK_DECODER=decoder, BENCHMARK_CHILD="1")
+    output = subprocess.run([sys.executable, __file__, str(RESULTS), str(REQUESTS)], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    cpu, wall = map(float, output.split()[-2:])
+    return cpu, wall
+
+if os.environ.get("BENCHMARK_CHILD"):
+    run_mode()
+else:
+    print(f"POST /api/search, {RESULTS} results per response, {REQUESTS} requests per mode")
+    default_cpu, default_wall = measure(False)
+    print(f"  default                      : {default_cpu:7.0f} µs CPU/request  {default_wall:7.0f} µs wall/request")
+    for decoder in ("msgspec", "pydantic"):
+        fast_cpu, fast_wall = measure(True, decoder)
+        print(f"  FAST_JSON ({decoder + ' decoder':<16}) : {fast_cpu:7.0f} µs CPU/request  {fast_wall:7.0f} µs wall/request"
+              f"  saved {default_cpu - fast_cpu:6.0f} µs ({(1 - fast_cpu / default_cpu) * 100:.0f}%)")
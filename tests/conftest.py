@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads DATABASE_URL at import time; unit tests never connect
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "db: needs a PostgreSQL database in TEST_DATABASE_URL")
@@ -0,0 +1,24 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_route_cursor_round_trip():
+    row = {"origin_port": "Шанхай", "destination_port": "LED", "id": "route-1"}
+
+    assert server.decode_route_cursor(server.encode_route_cursor(row)) == ["Шанхай", "LED", "route-1"]
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "WzFd", "e30=", "WzEsIDIsIDNd", "WyJMRUQiLCBudWxsLCAiciJd"])
+def test_invalid_route_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_route_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_route_filters_number_parameters_in_order():
+    conditions, args = server.route_filters("LED", None, "RZD", "ЖД")
+
+    assert conditions == ["origin_port = $1", "carrier = $2", "transport_type = $3"]
+    assert args == ["LED", "RZD", "ЖД"]
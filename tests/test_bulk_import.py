@@ -0,0 +1,121 @@
+import asyncio
+import os
+
+import pytest
+
+import server
+
+ROUTE_COLUMNS = ["id", "origin_port", "destination_port", "transport_type", "carrier",
+                 "transit_time_days", "base_price_usd", "available_container_types", "frequency"]
+
+
+class RecordingConn:
+    def __init__(self):
+        self.records = []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.records.extend(dict(zip(columns, record)) for record in records)
+
+
+def stage(rows, table="shipping_routes", columns=ROUTE_COLUMNS):
+    conn, errors = RecordingConn(), []
+    chunk = list(enumerate(rows, start=1))
+    staged = asyncio.run(server.stage_import_chunk(conn, table, chunk, server.IMPORT_MODELS[table], columns, errors))
+    return conn.records, errors, staged
+
+
+def route_row(**overrides):
+    row = {"origin_port": "SHA", "destination_port": "LED", "carrier": "RZD", "transit_time_days": "18",
+           "base_price_usd": "2100", "available_container_types": "20ft Standard;40ft Standard", "frequency": "Weekly"}
+    row.update(overrides)
+    return row
+
+
+def test_rows_without_id_get_a_stable_natural_key_id():
+    first, errors, _ = stage([route_row(), route_row(base_price_usd="1900"), route_row(carrier="FESCO")])
+    again, _, _ = stage([route_row(carrier=" rzd ")])
+
+    assert errors == []
+    assert first[0]["id"] == first[1]["id"] == again[0]["id"]
+    assert first[2]["id"] != first[0]["id"]
+    assert not any(record["id_provided"] for record in first)
+    assert first[0]["available_container_types"] == ["20ft Standard", "40ft Standard"]
+
+
+def test_explicit_ids_are_kept():
+    records, _, _ = stage([route_row(id="route-7")])
+
+    assert records[0]["id"] == "route-7"
+    assert records[0]["id_provided"] is True
+
+
+def test_ports_are_keyed_by_code():
+    columns = ["id", "name", "code", "country", "city"]
+    port = {"name": "Шанхай", "code": "SHA", "country": "Китай", "city": "Шанхай"}
+    records, _, _ = stage([port, dict(port, name="Shanghai")], table="ports", columns=columns)
+
+    assert records[0]["id"] == records[1]["id"] == server.natural_key_id("ports", {"code": "SHA"})
+
+
+def test_invalid_rows_stop_the_chunk_from_being_copied():
+    records, errors, staged = stage([route_row(), route_row(transit_time_days="soon")])
+
+    assert records == [] and staged == 1
+    assert errors[0]["row"] == 2 and "transit_time_days" in errors[0]["error"]
+
+
+def test_staged_json_columns_use_copy_compatible_codecs():
+    # Binary COPY refuses text-format codecs, and every import stages these JSONB list columns
+    class CodecRecorder:
+        codecs = {}
+
+        async def set_type_codec(self, type_name, **kwargs):
+            self.codecs[type_name] = kwargs
+
+    asyncio.run(server.init_db_connection(CodecRecorder()))
+    staged_json_columns = [
+        (table, column) for table, column in server.JSONB_COLUMNS
+        if table in server.IMPORT_MODELS and column in server.IMPORT_MODELS[table].model_fields
+    ]
+
+    assert staged_json_columns == [("ports", "transport_types"), ("shipping_routes", "available_container_types")]
+    assert CodecRecorder.codecs["jsonb"]["format"] == "binary"
+
+
+@pytest.mark.db
+def test_copy_into_staging_with_jsonb_columns():
+    asyncpg = pytest.importorskip("asyncpg")
+    database_url = os.environ.get("TEST_DATABASE_URL")
+    if not database_url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    async def scenario():
+        conn = await asyncpg.connect(database_url)
+        try:
+            await server.init_db_connection(conn)
+            async with conn.transaction():
+                await conn.execute('''
+                    CREATE TEMP TABLE import_staging (
+                        import_row BIGINT, id_provided BOOLEAN, id TEXT, origin_port TEXT, destination_port TEXT,
+                        transport_type TEXT, carrier TEXT, transit_time_days INTEGER, base_price_usd DOUBLE PRECISION,
+                        available_container_types JSONB, frequency TEXT
+                    ) ON COMMIT DROP
+                ''')
+                errors = []
+                chunk = [(1, route_row()), (2, route_row(id="route-7", carrier="FESCO"))]
+                await server.stage_import_chunk(conn, "shipping_routes", chunk, server.ShippingRoute, ROUTE_COLUMNS, errors)
+                rows = await conn.fetch('''
+                    SELECT id, id_provided, available_container_types,
+                           jsonb_typeof(available_container_types) AS json_type
+                    FROM import_staging ORDER BY import_row
+                ''')
+                return errors, rows
+        finally:
+            await conn.close()
+
+    errors, rows = asyncio.run(scenario())
+
+    assert errors == []
+    assert [row["available_container_types"] for row in rows] == [["20ft Standard", "40ft Standard"]] * 2
+    assert [row["json_type"] for row in rows] == ["array", "array"]
+    assert [row["id_provided"] for row in rows] == [False, True]
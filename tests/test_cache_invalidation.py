@@ -0,0 +1,38 @@
+import asyncio
+
+import server
+
+
+class RecordingConn:
+    def __init__(self, in_transaction: bool):
+        self.in_transaction = in_transaction
+        self.notified = []
+
+    def is_in_transaction(self):
+        return self.in_transaction
+
+    async def execute(self, query, *args):
+        self.notified.append(args)
+
+
+def test_publish_invalidation_outside_transaction_applies_locally():
+    generation = server.reference_cache._generations["ports"]
+    conn = RecordingConn(in_transaction=False)
+
+    payload = asyncio.run(server.publish_invalidation(conn, "ports"))
+
+    assert payload == "ports"
+    assert conn.notified == [(server.CACHE_INVALIDATION_CHANNEL, "ports")]
+    assert server.reference_cache._generations["ports"] == generation + 1
+
+
+def test_publish_invalidation_inside_transaction_defers_local_invalidation():
+    generation = server.reference_cache._generations["webhook_settings"]
+    conn = RecordingConn(in_transaction=True)
+
+    payload = asyncio.run(server.publish_invalidation(conn, "webhook_settings"))
+
+    assert conn.notified == [(server.CACHE_INVALIDATION_CHANNEL, "webhook_settings")]
+    assert server.reference_cache._generations["webhook_settings"] == generation
+    server.apply_invalidation(payload)
+    assert server.reference_cache._generations["webhook_settings"] == generation + 1
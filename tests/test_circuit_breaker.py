@@ -0,0 +1,102 @@
+import pytest
+
+import server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    monkeypatch.setattr(server, "CIRCUIT_WINDOW_SIZE", 10)
+    monkeypatch.setattr(server, "CIRCUIT_MIN_CALLS", 4)
+    monkeypatch.setattr(server, "CIRCUIT_FAILURE_RATE_THRESHOLD", 0.5)
+    monkeypatch.setattr(server, "CIRCUIT_SLOW_CALL_SECONDS", 5)
+    monkeypatch.setattr(server, "CIRCUIT_SLOW_CALL_RATE_THRESHOLD", 0.75)
+    monkeypatch.setattr(server, "CIRCUIT_OPEN_SECONDS", 30)
+    monkeypatch.setattr(server, "CIRCUIT_HALF_OPEN_CALLS", 2)
+    return clock
+
+
+def call(breaker, failed=False, duration=0.1):
+    assert breaker.allow()
+    breaker.record(failed, duration)
+
+
+def open_breaker(breaker):
+    for failed in (True, True, False, False):
+        call(breaker, failed=failed)
+    assert breaker.state == "open"
+
+
+def test_stays_closed_until_min_calls(clock):
+    breaker = server.CircuitBreaker("search")
+    for _ in range(3):
+        call(breaker, failed=True)
+
+    assert breaker.state == "closed"
+    call(breaker, failed=True)
+    assert breaker.state == "open" and breaker.opens == 1
+
+
+def test_failure_rate_below_threshold_keeps_it_closed(clock):
+    breaker = server.CircuitBreaker("search")
+    for failed in (True, False, False, False, True, False, False, False):
+        call(breaker, failed=failed)
+
+    assert breaker.state == "closed"
+
+
+def test_slow_call_rate_trips(clock):
+    breaker = server.CircuitBreaker("search")
+    for duration in (6, 6, 6, 0.1):
+        call(breaker, duration=duration)
+
+    assert breaker.state == "open"
+
+
+def test_open_rejects_until_cool_down_then_limits_trials(clock):
+    breaker = server.CircuitBreaker("search")
+    open_breaker(breaker)
+
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    clock.now += 1
+    assert breaker.allow() and breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.rejected == 2
+
+
+def test_good_trials_close_the_circuit(clock):
+    breaker = server.CircuitBreaker("search")
+    open_breaker(breaker)
+    clock.now += 30
+
+    call(breaker)
+    assert breaker.state == "half_open"
+    call(breaker)
+    assert breaker.state == "closed"
+    assert breaker.stats()["window_calls"] == 0
+
+
+@pytest.mark.parametrize("failed, duration", [(True, 0.1), (False, 6)])
+def test_bad_or_slow_trial_reopens(clock, failed, duration):
+    breaker = server.CircuitBreaker("search")
+    open_breaker(breaker)
+    clock.now += 30
+
+    call(breaker, failed=failed, duration=duration)
+
+    assert breaker.state == "open" and breaker.opens == 2
+    assert breaker.opened_at == clock.now
+    assert not breaker.allow()
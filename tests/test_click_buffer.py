@@ -0,0 +1,76 @@
+import asyncio
+
+import server
+
+
+class SlowCopyPool:
+    def __init__(self):
+        self.copied = []
+        self.copy_started = asyncio.Event()
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copy_started.set()
+        await asyncio.sleep(0.05)
+        self.copied.extend(records)
+
+
+def test_shutdown_during_copy_keeps_every_click(monkeypatch):
+    async def scenario():
+        pool = SlowCopyPool()
+
+        async def get_db_pool():
+            return pool
+
+        monkeypatch.setattr(server, "get_db_pool", get_db_pool)
+        buffer = server.ClickBuffer(flush_size=2, flush_interval=60, max_pending=100)
+        task = asyncio.create_task(buffer.run())
+        buffer.add("route-1", "user-1")
+        buffer.add("route-2", "user-1")
+        await pool.copy_started.wait()
+        buffer.add("route-3", "user-2")
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return pool, buffer
+
+    pool, buffer = asyncio.run(scenario())
+
+    assert [record[0] for record in pool.copied] == ["route-1", "route-2", "route-3"]
+    assert buffer.stats()["pending"] == 0
+
+
+def test_cancelled_flush_puts_the_batch_back(monkeypatch):
+    async def scenario():
+        pool = SlowCopyPool()
+
+        async def get_db_pool():
+            return pool
+
+        monkeypatch.setattr(server, "get_db_pool", get_db_pool)
+        buffer = server.ClickBuffer(flush_size=10, flush_interval=60, max_pending=100)
+        buffer.add("route-1", "user-1")
+        flush = asyncio.create_task(buffer.flush())
+        await pool.copy_started.wait()
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert buffer.stats()["pending"] == 1
+
+
+def test_clicks_are_stamped_in_utc():
+    buffer = server.ClickBuffer(flush_size=10, flush_interval=60, max_pending=100)
+    buffer.add("route-1", "user-1")
+
+    created_at = buffer._pending[0][2]
+    assert created_at.utcoffset() == server.timedelta(0)
@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import server
+
+LARGE_BODY = [{"code": f"P{i:04d}", "name": f"Порт {i}"} for i in range(200)]
+
+
+def make_client():
+    app = FastAPI()
+    entry = server.ReferenceEntry(LARGE_BODY, server.json.dumps(LARGE_BODY).encode(), 0)
+
+    @app.get("/large")
+    async def large():
+        return LARGE_BODY
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(3):
+                yield b"x" * 2048
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    @app.get("/reference")
+    async def reference(request: Request):
+        return server.conditional_response(request, entry)
+
+    app.add_middleware(server.CompressionMiddleware)
+    return TestClient(app), entry
+
+
+@pytest.mark.parametrize("accept, expected", [("gzip", "gzip"), ("br, gzip", "br"), ("br;q=0, gzip", "gzip")])
+def test_large_responses_are_compressed(accept, expected):
+    pytest.importorskip("brotli")
+    client, _ = make_client()
+    response = client.get("/large", headers={"Accept-Encoding": accept})
+
+    assert response.headers["content-encoding"] == expected
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == LARGE_BODY
+
+
+def test_small_and_streamed_responses_pass_through():
+    client, _ = make_client()
+
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    streamed = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in streamed.headers and len(streamed.content) == 3 * 2048
+
+
+def test_reference_etag_revalidation_returns_304():
+    client, entry = make_client()
+    first = client.get("/reference", headers={"Accept-Encoding": "gzip"})
+
+    assert first.headers["etag"] == entry.etag[:-1] + '-gzip"'
+    assert gzip.decompress(entry.encoded("gzip")) == entry.body
+    for accept in ("gzip", "identity"):
+        revalidated = client.get("/reference", headers={"Accept-Encoding": accept, "If-None-Match": first.headers["etag"]})
+        assert revalidated.status_code == 304 and revalidated.content == b""
+
+    changed = client.get("/reference", headers={"If-None-Match": '"stale"'})
+    assert changed.status_code == 200 and changed.json() == LARGE_BODY
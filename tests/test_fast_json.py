@@ -0,0 +1,69 @@
+import asyncio
+
+import orjson
+import pytest
+from fastapi.exceptions import RequestValidationError
+
+import server
+
+SEARCH_BODY = {
+    "origin_port": "SHA",
+    "destination_port": "LED",
+    "departure_date_from": "2025-03-03",
+    "departure_date_to": "2025-03-10",
+    "container_type": "40ft",
+    "containers_count": "2",
+}
+
+
+class RawRequest:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def body(self):
+        return self._body
+
+
+def decode(model, body):
+    return asyncio.run(server.fast_body(model)(RawRequest(orjson.dumps(body))))
+
+
+@pytest.fixture(params=["msgspec", "pydantic"])
+def decoder(request, monkeypatch):
+    if request.param == "msgspec":
+        pytest.importorskip("msgspec")
+    else:
+        monkeypatch.setattr(server, "msgspec", None)
+    return request.param
+
+
+def test_fast_body_matches_pydantic_validation(decoder):
+    query = decode(server.SearchQuery, SEARCH_BODY)
+
+    assert query == server.SearchQuery(**SEARCH_BODY)
+    assert query.containers_count == 2 and query.is_dangerous_cargo is False
+
+
+def test_fast_body_reports_errors_as_request_validation_errors(decoder):
+    with pytest.raises(RequestValidationError) as error:
+        decode(server.SearchQuery, {"origin_port": "SHA"})
+
+    assert all(item["loc"][0] == "body" for item in error.value.errors())
+
+
+def test_fast_body_defaults_are_not_shared(decoder):
+    body = {field: "x" for field in ("company_name", "contact_name", "contact_phone", "sender_phone",
+                                     "factory_address", "confirmation_email", "tnved_code",
+                                     "delivery_conditions", "route_id")}
+    body["search_query"] = {}
+    first = decode(server.BookingRequest, body)
+    first.uploaded_files.append("invoice.pdf")
+
+    assert decode(server.BookingRequest, body).uploaded_files == []
+
+
+def test_json_response_encodes_dates_and_numpy_values(monkeypatch):
+    monkeypatch.setattr(server, "FAST_JSON", True)
+    response = server.json_response([{"price": server.np.float64(1.5), "deadline": server.date(2025, 3, 3)}])
+
+    assert orjson.loads(response.body) == [{"price": 1.5, "deadline": "2025-03-03"}]
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class StubWebhook:
+    """Each call takes the next delay from `delays` and answers with its call number"""
+
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def __call__(self, endpoint, method, url, **kwargs):
+        call = self.calls
+        self.calls += 1
+        await asyncio.sleep(self.delays[call])
+        return FakeResponse({"call": call})
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_HEDGING_ENABLED", True)
+    monkeypatch.setattr(server, "SEARCH_HEDGE_DEFAULT_DELAY", 0.02)
+    monkeypatch.setattr(server, "SEARCH_HEDGE_MAX_RATE", 0.5)
+    monkeypatch.setattr(server, "hedge_policies", {})
+
+    def install(*delays):
+        stub = StubWebhook(*delays)
+        monkeypatch.setattr(server, "webhook_request", stub)
+        return stub
+
+    return install
+
+
+def search(url="http://search.test/hook"):
+    return server.hedged_search_webhook(url, {"from": "Shanghai", "to": "Moscow"})
+
+
+def test_delay_uses_latency_percentile(monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_HEDGE_MIN_SAMPLES", 10)
+    monkeypatch.setattr(server, "SEARCH_HEDGE_PERCENTILE", 0.9)
+    monkeypatch.setattr(server, "SEARCH_HEDGE_DEFAULT_DELAY", 2.0)
+    monkeypatch.setattr(server, "SEARCH_HEDGE_MIN_DELAY", 0.2)
+    policy = server.HedgePolicy()
+
+    for seconds in range(9):
+        policy.record_latency(seconds / 10)
+    assert policy.delay() == 2.0
+
+    policy.record_latency(0.9)
+    assert policy.delay() == pytest.approx(0.9)
+
+    fast = server.HedgePolicy()
+    for _ in range(10):
+        fast.record_latency(0.01)
+    assert fast.delay() == 0.2
+
+
+def test_fast_primary_sends_no_hedge(hedging):
+    stub = hedging(0.0)
+
+    assert asyncio.run(search()) == {"call": 0}
+    policy = server.hedge_policies["http://search.test/hook"]
+    assert stub.calls == 1 and policy.hedges == 0
+
+
+def test_slow_primary_loses_to_hedge(hedging):
+    stub = hedging(0.5, 0.0)
+
+    assert asyncio.run(search()) == {"call": 1}
+    policy = server.hedge_policies["http://search.test/hook"]
+    assert stub.calls == 2
+    assert policy.hedges == 1 and policy.hedge_wins == 1
+
+
+def test_max_rate_caps_hedges(hedging):
+    # Rate 0.5: the first slow request may hedge, the second must wait for its primary
+    stub = hedging(0.3, 0.0, 0.1)
+
+    async def scenario():
+        first = await search()
+        second = await search()
+        return first, second
+
+    assert asyncio.run(scenario()) == ({"call": 1}, {"call": 2})
+    policy = server.hedge_policies["http://search.test/hook"]
+    assert stub.calls == 3
+    assert policy.requests == 2 and policy.hedges == 1 and policy.hedge_wins == 1
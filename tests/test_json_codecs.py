@@ -0,0 +1,49 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import server
+
+
+class CodecRecorder:
+    def __init__(self):
+        self.codecs = {}
+
+    async def set_type_codec(self, type_name, **kwargs):
+        self.codecs[type_name] = kwargs
+
+
+def registered_codecs():
+    conn = CodecRecorder()
+    asyncio.run(server.init_db_connection(conn))
+    return conn.codecs
+
+
+def test_json_codecs_are_binary_so_copy_accepts_them():
+    codecs = registered_codecs()
+
+    assert set(codecs) == {"json", "jsonb"}
+    assert all(codec["format"] == "binary" for codec in codecs.values())
+
+
+def test_jsonb_wire_format_has_version_prefix():
+    codec = registered_codecs()["jsonb"]
+    value = ["Море", "ЖД", {"since": date(2025, 3, 3)}]
+
+    wire = codec["encoder"](value)
+
+    assert wire[:1] == b"\x01"
+    assert codec["decoder"](wire) == ["Море", "ЖД", {"since": "2025-03-03"}]
+
+
+def test_json_wire_format_is_plain_text():
+    codec = registered_codecs()["json"]
+
+    assert codec["encoder"](["20ft"]) == b'["20ft"]'
+    assert codec["decoder"](b'["20ft"]') == ["20ft"]
+
+
+def test_unknown_jsonb_version_is_rejected():
+    with pytest.raises(ValueError):
+        server.decode_jsonb_column(b'\x02["20ft"]')
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import date
+
+import server
+
+
+def calendar_query(**overrides):
+    values = {
+        "origin_port": "Shanghai",
+        "destination_port": "Hamburg",
+        "date_from": date(2025, 3, 3),
+        "date_to": date(2025, 3, 16),
+        "container_type": "40ft",
+    }
+    values.update(overrides)
+    return server.PriceCalendarQuery(**values)
+
+
+def run_windows(monkeypatch, execute_search, calendar):
+    monkeypatch.setattr(server, "execute_search", execute_search)
+
+    async def scenario():
+        semaphore = asyncio.Semaphore(2)
+        return await asyncio.gather(*(
+            server.price_calendar_window(calendar, window, {}, semaphore)
+            for window in server.calendar_windows(calendar)
+        ))
+
+    return list(asyncio.run(scenario()))
+
+
+def test_mock_results_do_not_price_the_lane(monkeypatch):
+    async def execute_search(query, ports=None):
+        return server.build_mock_results(query)
+
+    entries = run_windows(monkeypatch, execute_search, calendar_query())
+    summary = server.summarize_calendar(entries)
+
+    assert [entry["cheapest_price_usd"] for entry in entries] == [None, None]
+    assert [entry["result_count"] for entry in entries] == [0, 0]
+    assert summary["cheapest"] is None
+
+
+def test_cheapest_window_comes_from_real_quotes(monkeypatch):
+    async def execute_search(query, ports=None):
+        price = 900.0 if query.departure_date_from == date(2025, 3, 10) else 1200.0
+        return [{"price_from_usd": price, "carrier": "Sea Line"}] + server.build_mock_results(query)
+
+    entries = run_windows(monkeypatch, execute_search, calendar_query())
+    summary = server.summarize_calendar(entries)
+
+    assert [entry["cheapest_price_usd"] for entry in entries] == [1200.0, 900.0]
+    assert summary["cheapest"]["window_start"] == "2025-03-10"
+    assert summary["cheapest"]["carrier"] == "Sea Line"
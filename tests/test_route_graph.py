@@ -0,0 +1,65 @@
+import server
+
+
+def make_graph(edges):
+    routes = [
+        {
+            "id": f"r{i}",
+            "origin_port": origin,
+            "destination_port": destination,
+            "carrier": "Carrier",
+            "transport_type": "Море",
+            "transit_time_days": transit,
+            "base_price_usd": price,
+            "available_container_types": [],
+        }
+        for i, (origin, destination, price, transit) in enumerate(edges)
+    ]
+    return server.RouteGraph(routes, server.PortIndex([]))
+
+
+def legs(itinerary):
+    return [(leg["origin_port"], leg["destination_port"]) for leg in itinerary["legs"]]
+
+
+def test_hop_bound_uses_shortest_path_not_cheapest():
+    # Y reaches T directly for 100, or via Z and W for 3: the cheapest path from Y is the longer one
+    graph = make_graph([
+        ("P", "Q", 10, 1),
+        ("Q", "Y", 10, 1),
+        ("Y", "T", 100, 1),
+        ("Y", "Z", 1, 1),
+        ("Z", "W", 1, 1),
+        ("W", "T", 1, 1),
+    ])
+
+    _, min_hops = graph._bounds_to("T", "price", None)
+    assert min_hops["Q"] == 2
+    assert min_hops["P"] == 3
+
+    itineraries = graph.k_best("P", "T", k=5, max_hops=3)
+    assert [legs(itinerary) for itinerary in itineraries] == [[("P", "Q"), ("Q", "Y"), ("Y", "T")]]
+
+    itineraries = graph.k_best("P", "T", k=5, max_hops=5)
+    assert [itinerary["total_price_usd"] for itinerary in itineraries] == [23, 120]
+
+
+def test_k_best_orders_by_transit_time_with_transfers():
+    graph = make_graph([
+        ("A", "B", 500, 30),
+        ("A", "C", 100, 10),
+        ("C", "B", 100, 10),
+    ])
+
+    itineraries = graph.k_best("A", "B", k=2, max_hops=2, sort_by="transit_time")
+
+    assert [itinerary["total_transit_days"] for itinerary in itineraries] == [
+        20 + server.ROUTE_TRANSFER_DAYS, 30,
+    ]
+
+
+def test_removed_route_is_not_used():
+    graph = make_graph([("A", "B", 100, 10), ("A", "C", 10, 1), ("C", "B", 10, 1)])
+    graph.remove_route("r1")
+
+    assert [legs(itinerary) for itinerary in graph.k_best("A", "B", k=5, max_hops=3)] == [[("A", "B")]]